@@ -731,10 +731,17 @@ async def get_all_tasks(
     current_user: models.User = Depends(security.get_current_user),
     pool: aiomysql.Pool = Depends(get_db_pool),
     search: Optional[str] = Query(None, description="按标题搜索"),
-    status: Optional[str] = Query("all", description="按状态过滤: all, in_progress, completed")
+    status: Optional[str] = Query("all", description="按状态过滤: all, in_progress, completed"),
+    after_created_at: Optional[datetime] = Query(None, description="分页游标: 上一页最后一个任务的 created_at"),
+    after_id: Optional[str] = Query(None, description="分页游标: 上一页最后一个任务的 task_id"),
+    limit: int = Query(crud.TASK_HISTORY_PAGE_SIZE, ge=1, le=crud.TASK_HISTORY_MAX_PAGE_SIZE, description="每页条数")
 ):
-    """获取后台任务的列表和状态，支持搜索和过滤。"""
-    tasks = await crud.get_tasks_from_history(pool, search, status)
+    """获取后台任务的列表和状态，支持搜索、过滤和按游标分页。"""
+    if (after_created_at is None) != (after_id is None):
+        # 注意: 此处的 status 是查询参数，已遮蔽 fastapi.status 模块
+        raise HTTPException(status_code=422, detail="after_created_at 和 after_id 必须同时提供。")
+    after = (after_created_at, after_id) if after_id is not None else None
+    tasks = await crud.get_tasks_from_history(pool, search, status, after, limit)
     return [models.TaskInfo.model_validate(t) for t in tasks]
 
 @router.delete("/tasks/{task_id}", status_code=status.HTTP_204_NO_CONTENT, summary="删除一个历史任务")
@@ -765,7 +772,7 @@ async def get_all_api_tokens(
 ):
     """获取所有为第三方播放器创建的 API Token。"""
     tokens = await crud.get_all_api_tokens(pool)
-    return [models.ApiTokenInfo.model_validate(t) for t in tokens]
+    return [models.ApiTokenInfo.model_validate(t, from_attributes=True) for t in tokens]
 
 @router.post("/tokens", response_model=models.ApiTokenInfo, status_code=status.HTTP_201_CREATED, summary="创建一个新的API Token")
 async def create_new_api_token(
@@ -903,10 +910,8 @@ async def get_comments(
     if not await crud.check_episode_exists(pool, episode_id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Episode not found")
 
-    comments_data = await crud.fetch_comments(pool, episode_id)
-    
-    comments = [models.Comment(cid=item["cid"], p=item["p"], m=item["m"]) for item in comments_data]
-    return models.CommentResponse(count=len(comments), comments=comments)
+    # 由数据库直接组装好 CommentResponse 格式的 JSON，原样返回，无需逐条构建模型
+    return Response(content=await crud.fetch_comments_json(pool, episode_id), media_type="application/json")
 
 @router.get("/webhooks/available", response_model=List[str], summary="获取所有可用的Webhook类型")
 async def get_available_webhook_types(
@@ -16,6 +16,10 @@ class DatabaseConfig(BaseModel):
     user: str = "root"
     password: str = "password"
     name: str = "danmaku_db"
+    # 连接池配置，可通过环境变量覆盖，例如 DANMUAPI_DATABASE__POOL_MAXSIZE=50
+    pool_minsize: int = 5
+    pool_maxsize: int = 25
+    pool_recycle: int = 3600 # 连接回收时间（秒），应小于 MySQL 的 wait_timeout
 
 class JWTConfig(BaseModel):
     secret_key: str = "a_very_secret_key_that_should_be_changed"
@@ -1,14 +1,28 @@
+import asyncio
 import aiomysql
+import contextlib
 import json
+import orjson
 import logging
 import re
 import secrets
+import time
+from collections import namedtuple
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 
 from . import models, security
 
 
+async def _exec_noresult(conn: aiomysql.Connection, sql: str, params: tuple = ()) -> int:
+    """
+    不创建游标，直接在连接上执行一条不返回结果集的语句，返回受影响的行数。
+    参数的转义方式与 Cursor.execute 相同。
+    """
+    if params:
+        sql = sql % tuple(conn.escape(p) for p in params)
+    return await conn.query(sql)
+
 async def get_library_anime(pool: aiomysql.Pool) -> List[Dict[str, Any]]:
     """获取媒体库中的所有番剧及其关联信息（如分集数）"""
     async with pool.acquire() as conn:
@@ -44,6 +58,82 @@ async def search_anime(pool: aiomysql.Pool, keyword: str) -> List[Dict[str, Any]
             await cursor.execute(query, (sanitized_keyword + '*',))
             return await cursor.fetchall()
 
+# 弹幕库的版本号。导入、删除、重新关联等会改变库内搜索结果的写操作在提交后将其递增，
+# 缓存库内搜索结果的调用方将其纳入缓存键，使这些写入立即可见。
+_library_version = 0
+
+def _bump_library_version():
+    global _library_version
+    _library_version += 1
+
+def get_library_version() -> int:
+    """返回当前的弹幕库版本号。"""
+    return _library_version
+
+# 标题回退搜索时对主标题和所有别名进行 LIKE 匹配 (忽略全角冒号和空格的差异)
+_LIKE_TITLE_CONDITION = "(" + " OR ".join(
+    f"REPLACE(REPLACE({col}, '：', ':'), ' ', '') LIKE %s"
+    for col in ("a.title", "al.name_en", "al.name_jp", "al.name_romaji", "al.alias_cn_1", "al.alias_cn_2", "al.alias_cn_3")
+) + ")"
+
+def _fulltext_term(clean_title: str) -> str:
+    """将标题转换为 BOOLEAN MODE 的前缀搜索词 (移除操作符)。标题只包含操作符时返回空字符串。"""
+    sanitized = re.sub(r'[+\-><()~*@"]', ' ', clean_title).strip()
+    return sanitized + '*' if sanitized else ''
+
+def _like_title_params(clean_title: str) -> List[str]:
+    """_LIKE_TITLE_CONDITION 所需的参数列表。"""
+    normalized_like_title = f"%{clean_title.replace('：', ':').replace(' ', '')}%"
+    return [normalized_like_title] * _LIKE_TITLE_CONDITION.count("%s")
+
+async def _search_library_by_title(cursor, clean_title: str, query_template: str, extra_params: List[Any]) -> List[Any]:
+    """
+    先用 FULLTEXT 索引搜索主标题，无结果时回退到对主标题和所有别名的 LIKE 搜索。
+    query_template 中的 {title_condition} 会被替换为标题条件，extra_params 为其后的其余参数。
+    """
+    # 1. Try FULLTEXT search
+    sanitized_for_ft = _fulltext_term(clean_title)
+    if not sanitized_for_ft:
+        logging.info(f"Skipping FULLTEXT search for '{clean_title}' because it contains only operators/stopwords.")
+        results = []
+    else:
+        query_ft = query_template.format(title_condition="MATCH(a.title) AGAINST(%s IN BOOLEAN MODE)")
+        await cursor.execute(query_ft, tuple([sanitized_for_ft] + extra_params))
+        results = await cursor.fetchall()
+    if results:
+        return results
+
+    # 2. Fallback to LIKE search on main title and all aliases
+    logging.info(f"FULLTEXT search for '{clean_title}' yielded no results, falling back to LIKE search including aliases.")
+    
+    query_like = query_template.format(title_condition=_LIKE_TITLE_CONDITION)
+    like_params = _like_title_params(clean_title)
+    await cursor.execute(query_like, tuple(like_params + extra_params))
+    return await cursor.fetchall()
+
+# 分集搜索 (search_episodes_in_library 及其批量版本) 共用的查询列和连接
+_LIBRARY_EPISODE_COLUMNS = """
+            a.id AS animeId,
+            a.title AS animeTitle,
+            a.type,
+            a.image_url AS imageUrl,
+            a.created_at AS startDate,
+            e.id AS episodeId,
+            CASE
+                WHEN a.type = 'movie' THEN CONCAT(s.provider_name, ' 源')
+                ELSE e.title
+            END AS episodeTitle,
+            sc.display_order,
+            s.is_favorited AS isFavorited,
+            (SELECT COUNT(DISTINCT e_count.id) FROM anime_sources s_count JOIN episode e_count ON s_count.id = e_count.source_id WHERE s_count.anime_id = a.id) as totalEpisodeCount,
+            m.bangumi_id AS bangumiId"""
+_LIBRARY_EPISODE_FROM = """FROM episode e
+        JOIN anime_sources s ON e.source_id = s.id
+        JOIN anime a ON s.anime_id = a.id
+        JOIN scrapers sc ON s.provider_name = sc.provider_name
+        LEFT JOIN anime_metadata m ON a.id = m.anime_id
+        LEFT JOIN anime_aliases al ON a.id = al.anime_id"""
+
 async def search_episodes_in_library(pool: aiomysql.Pool, anime_title: str, episode_number: Optional[int], season_number: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     在本地库中通过番剧标题和可选的集数搜索匹配的分集。
@@ -59,6 +149,116 @@ async def search_episodes_in_library(pool: aiomysql.Pool, anime_title: str, epis
     season_condition = "AND a.season = %s" if season_number is not None else ""
     params_season = [season_number] if season_number is not None else []
 
+    query_template = f"""
+        SELECT {_LIBRARY_EPISODE_COLUMNS}
+        {_LIBRARY_EPISODE_FROM}
+        WHERE {{title_condition}} {episode_condition} {season_condition}
+        ORDER BY LENGTH(a.title) ASC, sc.display_order ASC
+    """
+
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            return await _search_library_by_title(cursor, clean_title, query_template, params_episode + params_season)
+
+async def search_episodes_in_library_batch(
+    pool: aiomysql.Pool, keys: List[Tuple[str, Optional[int], Optional[int]]]
+) -> Dict[Tuple[str, Optional[int], Optional[int]], List[Dict[str, Any]]]:
+    """
+    search_episodes_in_library 的批量版本，keys 为 (标题, 集数, 季度) 列表。
+    所有键的 FULLTEXT 搜索合并为一条 UNION ALL 查询，没有结果的键再合并为一条 LIKE 回退查询，
+    整批最多两次数据库往返。返回 {键: 结果列表}，每个键的结果及顺序与单独调用时相同。
+    """
+    results: Dict[Tuple[str, Optional[int], Optional[int]], List[Dict[str, Any]]] = {key: [] for key in keys}
+    keys = [key for key in results if key[0].strip()]
+
+    def _build_union(items: List[Tuple[int, str, List[Any]]]) -> Tuple[str, List[Any]]:
+        # 每个子查询带上所属键的序号，外层按序号分组后保持与单条查询相同的排序
+        parts, params = [], []
+        for idx, title_condition, title_params in items:
+            title, episode, season = keys[idx]
+            episode_condition = "AND e.episode_index = %s" if episode is not None else ""
+            season_condition = "AND a.season = %s" if season is not None else ""
+            parts.append(
+                f"(SELECT %s AS match_idx, {_LIBRARY_EPISODE_COLUMNS} {_LIBRARY_EPISODE_FROM} "
+                f"WHERE {title_condition} {episode_condition} {season_condition})"
+            )
+            params.append(idx)
+            params.extend(title_params)
+            params.extend(v for v in (episode, season) if v is not None)
+        query = f"SELECT * FROM ({' UNION ALL '.join(parts)}) AS u ORDER BY u.match_idx, LENGTH(u.animeTitle) ASC, u.display_order ASC"
+        return query, params
+
+    async def _run(cursor, items: List[Tuple[int, str, List[Any]]]) -> None:
+        if not items:
+            return
+        query, params = _build_union(items)
+        await cursor.execute(query, tuple(params))
+        for row in await cursor.fetchall():
+            results[keys[row.pop('match_idx')]].append(row)
+
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            # 1. FULLTEXT search for every key
+            ft_items = []
+            for idx, key in enumerate(keys):
+                term = _fulltext_term(key[0].strip())
+                if term:
+                    ft_items.append((idx, "MATCH(a.title) AGAINST(%s IN BOOLEAN MODE)", [term]))
+            await _run(cursor, ft_items)
+
+            # 2. Fallback to LIKE search for keys without FULLTEXT results
+            like_items = [
+                (idx, _LIKE_TITLE_CONDITION, _like_title_params(key[0].strip()))
+                for idx, key in enumerate(keys) if not results[key]
+            ]
+            if like_items:
+                logging.info(f"批量搜索中 {len(like_items)}/{len(keys)} 个标题的 FULLTEXT 搜索无结果，回退到包含别名的 LIKE 搜索。")
+            await _run(cursor, like_items)
+    return results
+
+async def find_animes_for_matching_batch(pool: aiomysql.Pool, titles: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    find_animes_for_matching 的批量版本：每个标题一个带 LIMIT 的子查询，合并为一条 UNION ALL 查询执行。
+    返回 {标题: 候选番剧列表}。
+    """
+    titles = list(dict.fromkeys(titles))
+    results: Dict[str, List[Dict[str, Any]]] = {title: [] for title in titles}
+    if not titles:
+        return results
+    parts, params = [], []
+    for idx, title in enumerate(titles):
+        parts.append(f"""
+            (SELECT DISTINCT %s AS match_idx, a.id as anime_id, m.tmdb_id, m.tmdb_episode_group_id, a.title
+            FROM anime a
+            LEFT JOIN anime_metadata m ON a.id = m.anime_id
+            LEFT JOIN anime_aliases al ON a.id = al.anime_id
+            WHERE {_LIKE_TITLE_CONDITION}
+            ORDER BY LENGTH(a.title) ASC
+            LIMIT 5)
+        """)
+        params.append(idx)
+        params.extend(_like_title_params(title))
+    query = f"SELECT * FROM ({' UNION ALL '.join(parts)}) AS u ORDER BY u.match_idx, LENGTH(u.title) ASC"
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(query, tuple(params))
+            for row in await cursor.fetchall():
+                results[titles[row.pop('match_idx')]].append(row)
+    return results
+
+async def search_animes_with_episodes_in_library(pool: aiomysql.Pool, anime_title: str, episode_number: Optional[int]) -> List[Dict[str, Any]]:
+    """
+    与 search_episodes_in_library 的搜索条件相同，但由数据库按番剧分组：每个番剧返回一行，
+    其 episodes 字段为该番剧匹配到的分集列表 [{"episodeId", "episodeTitle"}, ...]，
+    番剧和分集的顺序与扁平化结果中的先后顺序一致 (按标题长度和源顺序)。
+    """
+    clean_title = anime_title.strip()
+    if not clean_title:
+        return []
+
+    episode_condition = "AND e.episode_index = %s" if episode_number is not None else ""
+    params_episode = [episode_number] if episode_number is not None else []
+
     query_template = f"""
         SELECT
             a.id AS animeId,
@@ -66,60 +266,33 @@ async def search_episodes_in_library(pool: aiomysql.Pool, anime_title: str, epis
             a.type,
             a.image_url AS imageUrl,
             a.created_at AS startDate,
-            e.id AS episodeId,
-            CASE
-                WHEN a.type = 'movie' THEN CONCAT(s.provider_name, ' 源')
-                ELSE e.title
-            END AS episodeTitle,
-            sc.display_order,
-            s.is_favorited AS isFavorited,
             (SELECT COUNT(DISTINCT e_count.id) FROM anime_sources s_count JOIN episode e_count ON s_count.id = e_count.source_id WHERE s_count.anime_id = a.id) as totalEpisodeCount,
-            m.bangumi_id AS bangumiId
+            COALESCE(NULLIF(ANY_VALUE(m.bangumi_id), ''), CONCAT('A', a.id)) AS bangumiId,
+            JSON_ARRAYAGG(JSON_OBJECT(
+                'episodeId', e.id,
+                'episodeTitle', CASE WHEN a.type = 'movie' THEN CONCAT(s.provider_name, ' 源') ELSE e.title END,
+                'displayOrder', sc.display_order
+            )) AS episodes
         FROM episode e
         JOIN anime_sources s ON e.source_id = s.id
         JOIN anime a ON s.anime_id = a.id
         JOIN scrapers sc ON s.provider_name = sc.provider_name
         LEFT JOIN anime_metadata m ON a.id = m.anime_id
         LEFT JOIN anime_aliases al ON a.id = al.anime_id
-        WHERE {{title_condition}} {episode_condition} {season_condition}
-        ORDER BY LENGTH(a.title) ASC, sc.display_order ASC
+        WHERE {{title_condition}} {episode_condition}
+        GROUP BY a.id
+        ORDER BY LENGTH(a.title) ASC, MIN(sc.display_order) ASC
     """
 
     async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
-            # 1. Try FULLTEXT search
-            sanitized_for_ft = re.sub(r'[+\-><()~*@"]', ' ', clean_title).strip()
-            if not sanitized_for_ft:
-                logging.info(f"Skipping FULLTEXT search for '{clean_title}' because it contains only operators/stopwords.")
-                results = []
-            else:
-                query_ft = query_template.format(title_condition="MATCH(a.title) AGAINST(%s IN BOOLEAN MODE)")
-                await cursor.execute(query_ft, tuple([sanitized_for_ft + '*'] + params_episode + params_season))
-                results = await cursor.fetchall()
-            if results:
-                return results
-
-            # 2. Fallback to LIKE search on main title and all aliases
-            logging.info(f"FULLTEXT search for '{clean_title}' yielded no results, falling back to LIKE search including aliases.")
-            
-            normalized_like_title = f"%{clean_title.replace('：', ':').replace(' ', '')}%"
-            
-            like_conditions = [
-                "REPLACE(REPLACE(a.title, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.name_en, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.name_jp, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.name_romaji, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.alias_cn_1, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.alias_cn_2, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.alias_cn_3, '：', ':'), ' ', '') LIKE %s",
-            ]
-            
-            title_condition_like = f"({' OR '.join(like_conditions)})"
-            query_like = query_template.format(title_condition=title_condition_like)
-            
-            like_params = [normalized_like_title] * len(like_conditions)
-            await cursor.execute(query_like, tuple(like_params + params_episode + params_season))
-            return await cursor.fetchall()
+            results = await _search_library_by_title(cursor, clean_title, query_template, params_episode)
+    for row in results:
+        # JSON_ARRAYAGG 不保证元素顺序，按源顺序排序以与扁平化结果保持一致
+        episodes = orjson.loads(row['episodes'])
+        episodes.sort(key=lambda ep: ep['displayOrder'])
+        row['episodes'] = [{'episodeId': ep['episodeId'], 'episodeTitle': ep['episodeTitle']} for ep in episodes]
+    return results
 
 async def find_favorited_source_for_anime(pool: aiomysql.Pool, title: str, season: int) -> Optional[Dict[str, Any]]:
     """
@@ -165,7 +338,7 @@ async def search_animes_for_dandan(pool: aiomysql.Pool, keyword: str) -> List[Di
             a.image_url AS imageUrl,
             a.created_at AS startDate,
             (SELECT COUNT(DISTINCT e_count.id) FROM anime_sources s_count JOIN episode e_count ON s_count.id = e_count.source_id WHERE s_count.anime_id = a.id) as episodeCount,
-            m.bangumi_id AS bangumiId
+            COALESCE(NULLIF(m.bangumi_id, ''), CONCAT('A', a.id)) AS bangumiId
         FROM anime a
         LEFT JOIN anime_aliases al ON a.id = al.anime_id
         LEFT JOIN anime_metadata m ON a.id = m.anime_id
@@ -226,20 +399,8 @@ async def find_animes_for_matching(pool: aiomysql.Pool, title: str) -> List[Dict
     async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
             # 回退到对主标题和所有别名进行LIKE搜索
-            normalized_like_title = f"%{title.replace('：', ':').replace(' ', '')}%"
-            like_conditions = [
-                "REPLACE(REPLACE(a.title, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.name_en, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.name_jp, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.name_romaji, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.alias_cn_1, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.alias_cn_2, '：', ':'), ' ', '') LIKE %s",
-                "REPLACE(REPLACE(al.alias_cn_3, '：', ':'), ' ', '') LIKE %s",
-            ]
-            title_condition_like = f"({' OR '.join(like_conditions)})"
-            query_like = query_template.format(title_condition=title_condition_like)
-            like_params = [normalized_like_title] * len(like_conditions)
-            await cursor.execute(query_like, tuple(like_params))
+            query_like = query_template.format(title_condition=_LIKE_TITLE_CONDITION)
+            await cursor.execute(query_like, tuple(_like_title_params(title)))
             return await cursor.fetchall()
 
 async def find_episode_via_tmdb_mapping(
@@ -275,10 +436,15 @@ async def find_episode_via_tmdb_mapping(
             return await cursor.fetchall()
 
 async def get_anime_details_for_dandan(pool: aiomysql.Pool, anime_id: int) -> Optional[Dict[str, Any]]:
-    """获取番剧的详细信息及其所有分集，用于dandanplay API。"""
+    """
+    获取番剧的详细信息及其所有分集，用于dandanplay API。
+    番剧信息和分集列表由一条查询返回 (分集通过相关子查询聚合为 JSON 数组)，只需一次数据库往返。
+    """
     async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
-            # 1. 获取番剧基本信息
+            # 分集列表根据番剧类型决定：
+            # - 电影：每个数据源视为一个“分集”，并使用搜索源的顺序作为集数
+            # - 电视剧：正常的分集列表
             await cursor.execute("""
                 SELECT
                     a.id AS animeId,
@@ -288,43 +454,32 @@ async def get_anime_details_for_dandan(pool: aiomysql.Pool, anime_id: int) -> Op
                     a.created_at AS startDate,
                     a.source_url AS bangumiUrl,
                     (SELECT COUNT(DISTINCT e_count.id) FROM anime_sources s_count JOIN episode e_count ON s_count.id = e_count.source_id WHERE s_count.anime_id = a.id) as episodeCount,
-                    m.bangumi_id AS bangumiId
+                    COALESCE(NULLIF(m.bangumi_id, ''), CONCAT('A', a.id)) AS bangumiId,
+                    (
+                        SELECT JSON_ARRAYAGG(JSON_OBJECT(
+                            'episodeId', e.id,
+                            'episodeTitle', IF(a.type = 'movie', CONCAT(s.provider_name, ' 源'), e.title),
+                            'episodeNumber', IF(a.type = 'movie', sc.display_order, e.episode_index)
+                        ))
+                        FROM anime_sources s
+                        JOIN episode e ON s.id = e.source_id
+                        LEFT JOIN scrapers sc ON s.provider_name = sc.provider_name
+                        WHERE s.anime_id = a.id AND (a.type <> 'movie' OR sc.provider_name IS NOT NULL)
+                    ) AS episodes
                 FROM anime a
                 LEFT JOIN anime_metadata m ON a.id = m.anime_id
                 WHERE a.id = %s
             """, (anime_id,))
             anime_details = await cursor.fetchone()
 
-            if not anime_details:
-                return None
+    if not anime_details:
+        return None
 
-            episodes = []
-            # 2. 根据番剧类型决定如何获取“分集”列表
-            if anime_details['type'] == 'movie':
-                # 对于电影，我们将每个数据源视为一个“分集”，并使用搜索源的顺序作为集数
-                await cursor.execute("""
-                    SELECT
-                        e.id AS episodeId,
-                        CONCAT(s.provider_name, ' 源') AS episodeTitle,
-                        sc.display_order AS episodeNumber
-                    FROM anime_sources s
-                    JOIN episode e ON s.id = e.source_id
-                    JOIN scrapers sc ON s.provider_name = sc.provider_name
-                    WHERE s.anime_id = %s
-                    ORDER BY sc.display_order ASC
-                """, (anime_id,))
-                episodes = await cursor.fetchall()
-            else:
-                # 对于电视剧，正常获取分集列表
-                await cursor.execute("""
-                    SELECT e.id AS episodeId, e.title AS episodeTitle, e.episode_index AS episodeNumber
-                    FROM episode e JOIN anime_sources s ON e.source_id = s.id
-                    WHERE s.anime_id = %s ORDER BY e.episode_index ASC
-                """, (anime_id,))
-                episodes = await cursor.fetchall()
-
-            # 3. 返回整合后的数据
-            return {"anime": anime_details, "episodes": episodes}
+    # JSON_ARRAYAGG 不保证元素顺序，按集数 (电影为源顺序) 排序
+    episodes_json = anime_details.pop('episodes')
+    episodes = orjson.loads(episodes_json) if episodes_json else []
+    episodes.sort(key=lambda ep: ep['episodeNumber'])
+    return {"anime": anime_details, "episodes": episodes}
 
 async def get_anime_id_by_bangumi_id(pool: aiomysql.Pool, bangumi_id: str) -> Optional[int]:
     """通过 bangumi_id 查找 anime_id。"""
@@ -372,12 +527,37 @@ async def check_episode_exists(pool: aiomysql.Pool, episode_id: int) -> bool:
 
 
 async def fetch_comments(pool: aiomysql.Pool, episode_id: int) -> List[Dict[str, Any]]:
-    """获取指定分集的所有弹幕"""
+    """
+    获取指定分集的所有弹幕。
+    弹幕数量可达数万条，由数据库聚合为一个 JSON 数组后整体返回，再用 orjson 解析，
+    避免驱动逐行逐列地解析结果集。
+    """
     async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            query = "SELECT id as cid, p, m FROM comment WHERE episode_id = %s"
+        async with conn.cursor() as cursor:
+            query = """
+                SELECT JSON_ARRAYAGG(JSON_OBJECT('cid', id, 'p', p, 'm', m))
+                FROM comment WHERE episode_id = %s
+            """
             await cursor.execute(query, (episode_id,))
-            return await cursor.fetchall()
+            comments_json = (await cursor.fetchone())[0]
+    return orjson.loads(comments_json) if comments_json else []
+
+async def fetch_comments_json(pool: aiomysql.Pool, episode_id: int) -> str:
+    """
+    获取指定分集的所有弹幕，由数据库直接组装为 CommentResponse 格式的 JSON 文本:
+    {"count": N, "comments": [{"cid": ..., "p": ..., "m": ...}, ...]}
+    """
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            query = """
+                SELECT JSON_OBJECT(
+                    'count', COUNT(*),
+                    'comments', COALESCE(JSON_ARRAYAGG(JSON_OBJECT('cid', id, 'p', p, 'm', m)), JSON_ARRAY())
+                )
+                FROM comment WHERE episode_id = %s
+            """
+            await cursor.execute(query, (episode_id,))
+            return (await cursor.fetchone())[0]
 
 async def get_or_create_anime(pool: aiomysql.Pool, title: str, media_type: str, season: int, image_url: Optional[str]) -> int:
     """通过标题查找番剧，如果不存在则创建。如果存在但缺少海报，则更新海报。返回其ID。"""
@@ -392,6 +572,7 @@ async def get_or_create_anime(pool: aiomysql.Pool, title: str, media_type: str,
                 # 如果番剧已存在，但没有海报，而这次导入提供了海报，则更新它
                 if not existing_image_url and image_url:
                     await cursor.execute("UPDATE anime SET image_url = %s WHERE id = %s", (image_url, anime_id))
+                    _bump_library_version()
                 return anime_id
             
             # 2. 番剧不存在，在事务中创建新记录
@@ -443,6 +624,7 @@ async def get_or_create_episode(pool: aiomysql.Pool, source_id: int, episode_ind
                 "INSERT INTO episode (source_id, episode_index, provider_episode_id, title, source_url, fetched_at) VALUES (%s, %s, %s, %s, %s, %s)",
                 (source_id, episode_index, provider_episode_id, title, url, datetime.now())
             )
+            _bump_library_version()
             return cursor.lastrowid
 
 
@@ -564,13 +746,11 @@ async def clear_source_data(pool: aiomysql.Pool, source_id: int):
     """清空指定源的所有分集和弹幕，用于刷新。"""
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
-            await cursor.execute("SELECT id FROM episode WHERE source_id = %s", (source_id,))
-            episode_ids = [row[0] for row in await cursor.fetchall()]
-            if episode_ids:
-                format_strings = ','.join(['%s'] * len(episode_ids))
-                await cursor.execute(f"DELETE FROM comment WHERE episode_id IN ({format_strings})", tuple(episode_ids))
-                # 在此场景下，episode 很快会被删除，所以无需更新 comment_count
-                await cursor.execute(f"DELETE FROM episode WHERE id IN ({format_strings})", tuple(episode_ids))
+            # 直接按 source_id 关联删除，无需先取出分集ID再拼接 IN 列表
+            await cursor.execute("DELETE c FROM comment c JOIN episode e ON c.episode_id = e.id WHERE e.source_id = %s", (source_id,))
+            # 在此场景下，episode 很快会被删除，所以无需更新 comment_count
+            await cursor.execute("DELETE FROM episode WHERE source_id = %s", (source_id,))
+            _bump_library_version()
 
 async def clear_episode_comments(pool: aiomysql.Pool, episode_id: int):
     """清空指定分集的所有弹幕"""
@@ -653,6 +833,7 @@ async def update_anime_details(pool: aiomysql.Pool, anime_id: int, update_data:
                 ))
 
                 await conn.commit()
+                _bump_library_version()
                 return True
             except Exception as e:
                 await conn.rollback()
@@ -725,34 +906,31 @@ async def delete_anime_source(pool: aiomysql.Pool, source_id: int, conn: Optiona
     删除一个数据源及其所有关联的分集和弹幕。
     如果提供了 conn 参数，则在该连接上执行，不进行事务管理。
     """
-    _conn = conn or await pool.acquire()
-    try:
-        async with _conn.cursor() as cursor:
-            if not conn: await _conn.begin()
-
-            await cursor.execute("SELECT 1 FROM anime_sources WHERE id = %s", (source_id,))
-            if not await cursor.fetchone():
-                if not conn: await _conn.rollback()
-                return False
-
-            await cursor.execute("SELECT id FROM episode WHERE source_id = %s", (source_id,))
-            episode_ids = [row[0] for row in await cursor.fetchall()]
-
-            if episode_ids:
-                format_strings = ','.join(['%s'] * len(episode_ids))
-                await cursor.execute(f"DELETE FROM comment WHERE episode_id IN ({format_strings})", tuple(episode_ids))
-                await cursor.execute(f"DELETE FROM episode WHERE id IN ({format_strings})", tuple(episode_ids))
-
-            await cursor.execute("DELETE FROM anime_sources WHERE id = %s", (source_id,))
-            
-            if not conn: await _conn.commit()
-            return True
-    except Exception as e:
-        if not conn: await _conn.rollback()
-        logging.error(f"删除源 (ID: {source_id}) 时发生错误: {e}", exc_info=True)
-        return False
-    finally:
-        if not conn: pool.release(_conn)
+    async with contextlib.AsyncExitStack() as stack:
+        # 连接的获取与归还由 stack 管理，即使在获取后立即被取消也不会泄漏连接
+        _conn = conn or await stack.enter_async_context(pool.acquire())
+        try:
+            async with _conn.cursor() as cursor:
+                if not conn: await _conn.begin()
+
+                await cursor.execute("SELECT 1 FROM anime_sources WHERE id = %s", (source_id,))
+                if not await cursor.fetchone():
+                    if not conn: await _conn.rollback()
+                    return False
+
+                await cursor.execute("DELETE c FROM comment c JOIN episode e ON c.episode_id = e.id WHERE e.source_id = %s", (source_id,))
+                await cursor.execute("DELETE FROM episode WHERE source_id = %s", (source_id,))
+
+                await cursor.execute("DELETE FROM anime_sources WHERE id = %s", (source_id,))
+
+                if not conn:
+                    await _conn.commit()
+                    _bump_library_version()
+                return True
+        except Exception as e:
+            if not conn: await _conn.rollback()
+            logging.error(f"删除源 (ID: {source_id}) 时发生错误: {e}", exc_info=True)
+            return False
 
 async def reassociate_anime_sources(pool: aiomysql.Pool, source_anime_id: int, target_anime_id: int) -> bool:
     """将一个作品的所有数据源移动到另一个作品，并删除原作品。如果目标作品已存在相同源，则会删除源作品的重复源及其数据。"""
@@ -760,10 +938,11 @@ async def reassociate_anime_sources(pool: aiomysql.Pool, source_anime_id: int, t
         async with conn.cursor(aiomysql.DictCursor) as cursor:
             try:
                 await conn.begin()
-                await cursor.execute("SELECT 1 FROM anime WHERE id = %s", (source_anime_id,))
-                if not await cursor.fetchone(): return False
-                await cursor.execute("SELECT 1 FROM anime WHERE id = %s", (target_anime_id,))
-                if not await cursor.fetchone(): return False
+                # 一次查询确认源作品和目标作品都存在 (二者相同时只会返回一行，同样视为无效)
+                await cursor.execute("SELECT id FROM anime WHERE id IN (%s, %s)", (source_anime_id, target_anime_id))
+                if len(await cursor.fetchall()) != 2:
+                    await conn.rollback()
+                    return False
 
                 await cursor.execute("SELECT id, provider_name, media_id FROM anime_sources WHERE anime_id = %s", (source_anime_id,))
                 source_sources = await cursor.fetchall()
@@ -776,6 +955,7 @@ async def reassociate_anime_sources(pool: aiomysql.Pool, source_anime_id: int, t
 
                 await cursor.execute("DELETE FROM anime WHERE id = %s", (source_anime_id,))
                 await conn.commit()
+                _bump_library_version()
                 return True
             except Exception as e:
                 await conn.rollback()
@@ -788,6 +968,8 @@ async def update_episode_info(pool: aiomysql.Pool, episode_id: int, title: str,
         async with conn.cursor() as cursor:
             query = "UPDATE episode SET title = %s, episode_index = %s, source_url = %s WHERE id = %s"
             affected_rows = await cursor.execute(query, (title, episode_index, source_url, episode_id))
+            if affected_rows > 0:
+                _bump_library_version()
             return affected_rows > 0
 
 async def delete_anime(pool: aiomysql.Pool, anime_id: int) -> bool:
@@ -800,25 +982,17 @@ async def delete_anime(pool: aiomysql.Pool, anime_id: int) -> bool:
             try:
                 await conn.begin()  # 开始事务
 
-                # 1. 获取该作品关联的所有源ID
-                await cursor.execute("SELECT id FROM anime_sources WHERE anime_id = %s", (anime_id,))
-                source_ids = [row[0] for row in await cursor.fetchall()]
-
-                if source_ids:
-                    # 2. 获取所有源关联的所有分集ID
-                    format_strings_sources = ','.join(['%s'] * len(source_ids))
-                    await cursor.execute(f"SELECT id FROM episode WHERE source_id IN ({format_strings_sources})", tuple(source_ids))
-                    episode_ids = [row[0] for row in await cursor.fetchall()]
-
-                    if episode_ids:
-                        # 3. 删除所有分集关联的弹幕
-                        format_strings_episodes = ','.join(['%s'] * len(episode_ids))
-                        await cursor.execute(f"DELETE FROM comment WHERE episode_id IN ({format_strings_episodes})", tuple(episode_ids))
-                        # 4. 删除所有分集
-                        await cursor.execute(f"DELETE FROM episode WHERE id IN ({format_strings_episodes})", tuple(episode_ids))
-                    
-                    # 5. 删除所有源记录
-                    await cursor.execute(f"DELETE FROM anime_sources WHERE id IN ({format_strings_sources})", tuple(source_ids))
+                # 1. 删除该作品所有源下所有分集关联的弹幕
+                await cursor.execute("""
+                    DELETE c FROM comment c
+                    JOIN episode e ON c.episode_id = e.id
+                    JOIN anime_sources s ON e.source_id = s.id
+                    WHERE s.anime_id = %s
+                """, (anime_id,))
+                # 2-4. 删除所有分集
+                await cursor.execute("DELETE e FROM episode e JOIN anime_sources s ON e.source_id = s.id WHERE s.anime_id = %s", (anime_id,))
+                # 5. 删除所有源记录
+                await cursor.execute("DELETE FROM anime_sources WHERE anime_id = %s", (anime_id,))
 
                 # 6. 删除元数据 (别名表有级联删除，元数据表没有，需要手动删除)
                 await cursor.execute("DELETE FROM anime_metadata WHERE anime_id = %s", (anime_id,))
@@ -826,6 +1000,7 @@ async def delete_anime(pool: aiomysql.Pool, anime_id: int) -> bool:
                 # 7. 删除作品本身
                 affected_rows = await cursor.execute("DELETE FROM anime WHERE id = %s", (anime_id,))
                 await conn.commit()  # 提交事务
+                _bump_library_version()
                 return affected_rows > 0
             except Exception as e:
                 await conn.rollback()  # 如果出错则回滚
@@ -845,6 +1020,7 @@ async def delete_episode(pool: aiomysql.Pool, episode_id: int) -> bool:
                 # 2. 删除分集
                 affected_rows = await cursor.execute("DELETE FROM episode WHERE id = %s", (episode_id,))
                 await conn.commit()
+                _bump_library_version()
                 return affected_rows > 0
             except Exception as e:
                 await conn.rollback()
@@ -890,12 +1066,6 @@ async def update_scrapers_settings(pool: aiomysql.Pool, settings: List[models.Sc
             data_to_update = [(s.is_enabled, s.display_order, s.provider_name) for s in settings]
             await cursor.executemany(query, data_to_update)
 
-async def update_episode_fetch_time(pool: aiomysql.Pool, episode_id: int):
-    """更新分集的采集时间"""
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("UPDATE episode SET fetched_at = %s WHERE id = %s", (datetime.now(), episode_id))
-
 # --- 数据库缓存服务 ---
 
 async def update_metadata_if_empty(
@@ -938,13 +1108,21 @@ async def check_source_exists_by_media_id(pool: aiomysql.Pool, provider: str, me
             )
             return await cursor.fetchone() is not None
 
+# 进程内配置缓存。所有配置写入都经由 update_config_value，因此可以在写入时同步刷新。
+_config_cache: Dict[str, str] = {}
+
 async def get_config_value(pool: aiomysql.Pool, key: str, default: str) -> str:
-    """从数据库获取配置值。"""
+    """从数据库获取配置值。已读取过的配置项直接从进程内缓存返回。"""
+    if key in _config_cache:
+        return _config_cache[key]
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
             await cursor.execute("SELECT config_value FROM config WHERE config_key = %s", (key,))
             result = await cursor.fetchone()
-            return result[0] if result else default
+            if not result:
+                return default
+            _config_cache[key] = result[0]
+            return result[0]
 
 async def get_cache(pool: aiomysql.Pool, key: str) -> Optional[Any]:
     """从数据库缓存中获取数据。"""
@@ -954,16 +1132,18 @@ async def get_cache(pool: aiomysql.Pool, key: str) -> Optional[Any]:
             result = await cursor.fetchone()
             if result:
                 try:
-                    return json.loads(result[0])
-                except json.JSONDecodeError:
+                    return orjson.loads(result[0])
+                except orjson.JSONDecodeError:
                     return None # 缓存数据损坏
     return None
 
 async def set_cache(pool: aiomysql.Pool, key: str, value: Any, ttl_seconds: int, provider: Optional[str] = None):
     """将数据存入数据库缓存。"""
+    # 在获取连接之前完成序列化，避免大对象编码期间占用连接池中的连接
+    # orjson 始终输出 UTF-8，无需 ensure_ascii；OPT_NON_STR_KEYS 保持与 json.dumps 一致的非字符串键处理
+    json_value = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
-            json_value = json.dumps(value, ensure_ascii=False)
             query = """
                 INSERT INTO cache_data (cache_provider, cache_key, cache_value, expires_at) 
                 VALUES (%s, %s, %s, NOW() + INTERVAL %s SECOND) 
@@ -984,6 +1164,9 @@ async def update_config_value(pool: aiomysql.Pool, key: str, value: str):
                 ON DUPLICATE KEY UPDATE config_value = new_values.config_value
             """
             await cursor.execute(query, (key, value))
+    _config_cache[key] = value
+    if key == 'ua_filter_mode':
+        _invalidate_ua_matcher_cache()
 
 async def clear_expired_cache(pool: aiomysql.Pool):
     """从数据库中清除过期的缓存条目。"""
@@ -1018,20 +1201,43 @@ async def delete_cache(pool: aiomysql.Pool, key: str) -> bool:
             affected_rows = await cursor.execute("DELETE FROM cache_data WHERE cache_key = %s", (key,))
             return affected_rows > 0
 
+# 待写入采集时间的分集ID，由 flush_episode_fetch_times 定期批量写入
+_pending_fetch_time_ids: set = set()
+
 async def update_episode_fetch_time(pool: aiomysql.Pool, episode_id: int):
-    """更新分集的采集时间"""
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("UPDATE episode SET fetched_at = %s WHERE id = %s", (datetime.now(), episode_id))
+    """更新分集的采集时间。仅登记分集ID，实际写入由后台任务批量完成。"""
+    _pending_fetch_time_ids.add(episode_id)
+
+async def flush_episode_fetch_times(pool: aiomysql.Pool) -> int:
+    """将所有待写入的分集采集时间合并为一条 UPDATE 写入数据库。返回写入的分集数。"""
+    if not _pending_fetch_time_ids:
+        return 0
+    episode_ids = list(_pending_fetch_time_ids)
+    _pending_fetch_time_ids.clear()
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                # 以单个 JSON 数组参数传入ID，语句文本不随ID数量变化
+                await cursor.execute(
+                    "UPDATE episode e JOIN JSON_TABLE(%s, '$[*]' COLUMNS(id BIGINT PATH '$')) j ON e.id = j.id SET e.fetched_at = %s",
+                    (json.dumps(episode_ids), datetime.now())
+                )
+    except Exception:
+        # 写入失败时放回队列，等待下一次刷新
+        _pending_fetch_time_ids.update(episode_ids)
+        raise
+    return len(episode_ids)
 
 # --- API Token 管理服务 ---
 
-async def get_all_api_tokens(pool: aiomysql.Pool) -> List[Dict[str, Any]]:
+ApiTokenRow = namedtuple('ApiTokenRow', 'id name token is_enabled expires_at created_at')
+
+async def get_all_api_tokens(pool: aiomysql.Pool) -> List[ApiTokenRow]:
     """获取所有 API Token。"""
     async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
+        async with conn.cursor() as cursor:
             await cursor.execute("SELECT id, name, token, is_enabled, expires_at, created_at FROM api_tokens ORDER BY created_at DESC")
-            return await cursor.fetchall()
+            return [ApiTokenRow(*row) for row in await cursor.fetchall()]
 
 async def get_api_token_by_id(pool: aiomysql.Pool, token_id: int) -> Optional[Dict[str, Any]]:
     """通过ID获取一个 API Token。"""
@@ -1060,6 +1266,8 @@ async def create_api_token(pool: aiomysql.Pool, name: str, token: str, validity_
                 "INSERT INTO api_tokens (name, token, expires_at) VALUES (%s, %s, %s)",
                 (name, token, expires_at)
             )
+            # 新令牌此前可能以“不存在”的状态被缓存
+            _invalidate_api_token_cache()
             return cursor.lastrowid
 
 async def delete_api_token(pool: aiomysql.Pool, token_id: int) -> bool:
@@ -1067,6 +1275,7 @@ async def delete_api_token(pool: aiomysql.Pool, token_id: int) -> bool:
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
             affected_rows = await cursor.execute("DELETE FROM api_tokens WHERE id = %s", (token_id,))
+            _invalidate_api_token_cache()
             return affected_rows > 0
 
 async def toggle_api_token(pool: aiomysql.Pool, token_id: int) -> bool:
@@ -1074,24 +1283,71 @@ async def toggle_api_token(pool: aiomysql.Pool, token_id: int) -> bool:
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
             affected_rows = await cursor.execute("UPDATE api_tokens SET is_enabled = NOT is_enabled WHERE id = %s", (token_id,))
+            _invalidate_api_token_cache()
             return affected_rows > 0
 
-async def validate_api_token(pool: aiomysql.Pool, token: str) -> Optional[Dict[str, Any]]:
-    """验证一个 API Token 是否有效且已启用。如果有效，返回token信息，否则返回None。"""
+# 令牌校验结果的进程内缓存：每个 dandanplay 请求都要校验令牌，而令牌极少变化。
+# 缓存值为 (失效时间, 查询的 Future)，并发的相同令牌请求等待同一次查询。
+# 令牌被创建、删除或启停时整体失效；有效期将尽的令牌缓存时间不超过其剩余有效期。
+_API_TOKEN_CACHE_TTL = 60.0
+_API_TOKEN_CACHE_MAXSIZE = 1024
+_api_token_cache: Dict[str, Tuple[float, asyncio.Future]] = {}
+
+def _invalidate_api_token_cache():
+    """清空令牌校验缓存。"""
+    _api_token_cache.clear()
+
+async def _fetch_api_token_status(pool: aiomysql.Pool, token: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+    """查询令牌状态，返回 (令牌信息, 剩余有效秒数)。永久令牌的剩余有效秒数为 None。"""
     async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
+            # 过期判断交由数据库完成 (expires_at 以 UTC 时间存储)
             await cursor.execute(
-                "SELECT id, expires_at FROM api_tokens WHERE token = %s AND is_enabled = TRUE",
+                """
+                SELECT id,
+                    CASE
+                        WHEN expires_at IS NOT NULL AND expires_at <= UTC_TIMESTAMP() THEN 'denied_expired'
+                        WHEN NOT is_enabled THEN 'denied_disabled'
+                        ELSE 'allowed'
+                    END AS status,
+                    TIMESTAMPDIFF(SECOND, UTC_TIMESTAMP(), expires_at) AS expires_in
+                FROM api_tokens WHERE token = %s
+                """,
                 (token,)
             )
-            token_info = await cursor.fetchone()
-            if not token_info:
-                return None
-            
-            if token_info['expires_at'] and token_info['expires_at'].replace(tzinfo=timezone.utc) < datetime.now(timezone.utc):
-                return None # Token has expired
+            row = await cursor.fetchone()
+    if row is None:
+        return None, None
+    expires_in = row.pop('expires_in')
+    return row, expires_in
 
-            return token_info
+async def validate_api_token(pool: aiomysql.Pool, token: str) -> Optional[Dict[str, Any]]:
+    """
+    校验 API Token，结果在进程内缓存。token 不存在时返回 None，否则返回 {'id', 'status'}，
+    status 为 'allowed'、'denied_expired' 或 'denied_disabled'，可直接用作访问日志的状态。
+    返回的字典在调用方之间共享，不应被修改。
+    """
+    entry = _api_token_cache.get(token)
+    if entry is None or time.monotonic() >= entry[0]:
+        _api_token_cache.pop(token, None)
+        if len(_api_token_cache) >= _API_TOKEN_CACHE_MAXSIZE:
+            _api_token_cache.pop(next(iter(_api_token_cache)))
+        future = asyncio.ensure_future(_fetch_api_token_status(pool, token))
+        entry = (time.monotonic() + _API_TOKEN_CACHE_TTL, future)
+        _api_token_cache[token] = entry
+    try:
+        # shield: 某个调用方被取消时，不影响正在等待同一查询的其他调用方
+        token_info, expires_in = await asyncio.shield(entry[1])
+    except Exception:
+        if _api_token_cache.get(token) is entry:
+            del _api_token_cache[token]
+        raise
+    if expires_in is not None and token_info['status'] == 'allowed' and _api_token_cache.get(token) is entry:
+        # 令牌在缓存失效前就会过期时，缩短缓存时间，使其按时变为过期状态
+        deadline = time.monotonic() + expires_in
+        if deadline < entry[0]:
+            _api_token_cache[token] = (deadline, entry[1])
+    return token_info
 
 # --- UA Filter and Log Services ---
 
@@ -1101,26 +1357,111 @@ async def get_ua_rules(pool: aiomysql.Pool) -> List[Dict[str, Any]]:
             await cursor.execute("SELECT id, ua_string, created_at FROM ua_rules ORDER BY created_at DESC")
             return await cursor.fetchall()
 
+async def get_ua_strings(pool: aiomysql.Pool) -> List[str]:
+    """仅获取所有UA规则字符串，供请求鉴权时的UA过滤使用。"""
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute("SELECT ua_string FROM ua_rules")
+            return [row[0] for row in await cursor.fetchall()]
+
+# 所有 UA 规则预编译为一个正则表达式并缓存在进程内，规则增删或过滤模式变更时失效。
+# 键 'pattern' 不存在表示尚未加载；值为 None 表示没有任何规则。
+# 键 'policy' 缓存 (过滤模式, 匹配器) 二元组，鉴权时只需一次字典查找。
+_ua_matcher_cache: Dict[str, Any] = {}
+# 每次失效时递增。加载期间若缓存被清空 (规则或过滤模式在加载途中被修改)，
+# 加载得到的结果可能已过时，此时只返回给本次调用方而不写入缓存。
+_ua_matcher_generation = 0
+
+def _invalidate_ua_matcher_cache():
+    """清空UA匹配器缓存。在UA规则或过滤模式变更后调用。"""
+    global _ua_matcher_generation
+    _ua_matcher_generation += 1
+    _ua_matcher_cache.clear()
+
+async def get_ua_matcher(pool: aiomysql.Pool) -> Optional[re.Pattern]:
+    """
+    获取匹配任意一条UA规则 (子串匹配) 的预编译正则，没有规则时返回 None。
+    用一次正则扫描代替对每条规则分别执行 `rule in user_agent`。
+    """
+    if 'pattern' in _ua_matcher_cache:
+        return _ua_matcher_cache['pattern']
+    generation = _ua_matcher_generation
+    ua_list = await get_ua_strings(pool)
+    pattern = re.compile('|'.join(map(re.escape, ua_list))) if ua_list else None
+    if generation == _ua_matcher_generation:
+        _ua_matcher_cache['pattern'] = pattern
+    return pattern
+
+async def get_ua_policy(pool: aiomysql.Pool) -> Tuple[str, Optional[re.Pattern]]:
+    """
+    返回 (ua_filter_mode, 匹配器)。过滤模式为 'off' 时不加载UA规则，匹配器为 None。
+    """
+    policy = _ua_matcher_cache.get('policy')
+    if policy is None:
+        generation = _ua_matcher_generation
+        mode = await get_config_value(pool, 'ua_filter_mode', 'off')
+        matcher = await get_ua_matcher(pool) if mode != 'off' else None
+        policy = (mode, matcher)
+        if generation == _ua_matcher_generation:
+            _ua_matcher_cache['policy'] = policy
+    return policy
+
 async def add_ua_rule(pool: aiomysql.Pool, ua_string: str) -> int:
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
             await cursor.execute("INSERT INTO ua_rules (ua_string) VALUES (%s)", (ua_string,))
+            _invalidate_ua_matcher_cache()
             return cursor.lastrowid
 
 async def delete_ua_rule(pool: aiomysql.Pool, rule_id: int) -> bool:
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
             affected_rows = await cursor.execute("DELETE FROM ua_rules WHERE id = %s", (rule_id,))
+            _invalidate_ua_matcher_cache()
             return affected_rows > 0
 
-async def create_token_access_log(pool: aiomysql.Pool, token_id: int, ip_address: str, user_agent: Optional[str], log_status: str, path: Optional[str] = None):
+# 访问日志先进入内存队列，由 token_access_log_worker 批量写入，避免在请求路径上等待数据库
+_access_log_queue: asyncio.Queue = asyncio.Queue(maxsize=10000)
+_ACCESS_LOG_BATCH_SIZE = 256
+
+async def _insert_token_access_logs(pool: aiomysql.Pool, rows: List[tuple]):
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
-            await cursor.execute(
+            # executemany 会将其改写为一条多行 VALUES 的 INSERT
+            await cursor.executemany(
                 "INSERT INTO token_access_logs (token_id, ip_address, user_agent, status, path) VALUES (%s, %s, %s, %s, %s)",
-                (token_id, ip_address, user_agent, log_status, path)
+                rows
             )
 
+def create_token_access_log(token_id: int, ip_address: str, user_agent: Optional[str], log_status: str, path: Optional[str] = None):
+    """将一条访问日志放入队列，立即返回，不在请求路径上访问数据库。"""
+    row = (token_id, ip_address, user_agent, log_status, path)
+    if _access_log_queue.full():
+        # 队列已满 (数据库长时间不可用) 时丢弃最旧的一条，保证请求永不因日志阻塞
+        _access_log_queue.get_nowait()
+        logging.getLogger(__name__).warning("Token访问日志队列已满，已丢弃最旧的一条日志。")
+    _access_log_queue.put_nowait(row)
+
+async def flush_token_access_logs(pool: aiomysql.Pool) -> int:
+    """将队列中剩余的访问日志全部写入数据库。返回写入的条数。"""
+    rows = []
+    while not _access_log_queue.empty():
+        rows.append(_access_log_queue.get_nowait())
+    for i in range(0, len(rows), _ACCESS_LOG_BATCH_SIZE):
+        await _insert_token_access_logs(pool, rows[i:i + _ACCESS_LOG_BATCH_SIZE])
+    return len(rows)
+
+async def token_access_log_worker(pool: aiomysql.Pool):
+    """后台任务：持续从队列中取出访问日志并批量写入数据库。"""
+    while True:
+        batch = [await _access_log_queue.get()]
+        while len(batch) < _ACCESS_LOG_BATCH_SIZE and not _access_log_queue.empty():
+            batch.append(_access_log_queue.get_nowait())
+        try:
+            await _insert_token_access_logs(pool, batch)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"写入 {len(batch)} 条Token访问日志失败: {e}")
+
 async def get_token_access_logs(pool: aiomysql.Pool, token_id: int) -> List[Dict[str, Any]]:
     async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
@@ -1140,8 +1481,8 @@ async def toggle_source_favorite_status(pool: aiomysql.Pool, source_id: int) ->
 
             try:
                 await conn.begin()
-                # 将此作品下的所有其他源都设为非精确
-                await cursor.execute("UPDATE anime_sources SET is_favorited = FALSE WHERE anime_id = %s AND id != %s", (anime_id, source_id))
+                # 将此作品下的所有其他源都设为非精确 (只需处理当前已标记的源，可直接命中 idx_anime_favorited 索引)
+                await cursor.execute("UPDATE anime_sources SET is_favorited = FALSE WHERE anime_id = %s AND is_favorited = TRUE AND id != %s", (anime_id, source_id))
                 # 切换目标源的精确标记状态
                 await cursor.execute("UPDATE anime_sources SET is_favorited = NOT is_favorited WHERE id = %s", (source_id,))
                 await conn.commit()
@@ -1225,17 +1566,41 @@ async def delete_bangumi_auth(pool: aiomysql.Pool, user_id: int) -> bool:
 
 # --- Scheduled Tasks ---
 
-async def get_animes_with_tmdb_id(pool: aiomysql.Pool) -> List[Dict[str, Any]]:
-    """获取所有已关联TMDB ID的电视节目。"""
+async def count_animes_with_tmdb_id(pool: aiomysql.Pool) -> int:
+    """统计已关联TMDB ID的电视节目数量。"""
     async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
+        async with conn.cursor() as cursor:
             await cursor.execute("""
-                SELECT a.id as anime_id, a.title, m.tmdb_id, m.tmdb_episode_group_id
+                SELECT COUNT(*)
                 FROM anime a
                 JOIN anime_metadata m ON a.id = m.anime_id
                 WHERE a.type = 'tv_series' AND m.tmdb_id IS NOT NULL AND m.tmdb_id != ''
             """)
-            return await cursor.fetchall()
+            return (await cursor.fetchone())[0]
+
+async def get_animes_with_tmdb_id(pool: aiomysql.Pool, batch_size: int = 200) -> AsyncIterator[Dict[str, Any]]:
+    """
+    逐条产出所有已关联TMDB ID的电视节目。
+    按 anime_id 分页读取，每页读取完毕即归还连接，避免在调用方处理期间长时间占用连接或游标。
+    """
+    last_id = 0
+    while True:
+        async with pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute("""
+                    SELECT a.id as anime_id, a.title, m.tmdb_id, m.tmdb_episode_group_id
+                    FROM anime a
+                    JOIN anime_metadata m ON a.id = m.anime_id
+                    WHERE a.type = 'tv_series' AND m.tmdb_id IS NOT NULL AND m.tmdb_id != '' AND a.id > %s
+                    ORDER BY a.id
+                    LIMIT %s
+                """, (last_id, batch_size))
+                rows = await cursor.fetchall()
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['anime_id']
 
 async def update_anime_tmdb_group_id(pool: aiomysql.Pool, anime_id: int, group_id: str):
     """更新一个作品的TMDB剧集组ID。"""
@@ -1248,126 +1613,379 @@ async def update_anime_tmdb_group_id(pool: aiomysql.Pool, anime_id: int, group_i
 
 async def update_anime_aliases_if_empty(pool: aiomysql.Pool, anime_id: int, aliases: Dict[str, Any]):
     """如果本地别名字段为空，则使用提供的别名进行更新。"""
+    cn_aliases = aliases.get('aliases_cn', [])
+    # 仅在原值为空 (NULL 或 '') 时写入新值；未提供的字段传入 NULL，落到最后一项保留原值 (包括原有的 '')
+    params = (
+        aliases.get('name_en') or None,
+        aliases.get('name_jp') or None,
+        aliases.get('name_romaji') or None,
+        cn_aliases[0] if len(cn_aliases) > 0 else None,
+        cn_aliases[1] if len(cn_aliases) > 1 else None,
+        cn_aliases[2] if len(cn_aliases) > 2 else None,
+        anime_id,
+    )
     async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            await cursor.execute("SELECT name_en, name_jp, name_romaji, alias_cn_1, alias_cn_2, alias_cn_3 FROM anime_aliases WHERE anime_id = %s", (anime_id,))
-            current = await cursor.fetchone()
-            if not current: return
+        async with conn.cursor() as cursor:
+            affected_rows = await cursor.execute("""
+                UPDATE anime_aliases SET
+                    name_en = COALESCE(NULLIF(name_en, ''), NULLIF(%s, ''), name_en),
+                    name_jp = COALESCE(NULLIF(name_jp, ''), NULLIF(%s, ''), name_jp),
+                    name_romaji = COALESCE(NULLIF(name_romaji, ''), NULLIF(%s, ''), name_romaji),
+                    alias_cn_1 = COALESCE(NULLIF(alias_cn_1, ''), NULLIF(%s, ''), alias_cn_1),
+                    alias_cn_2 = COALESCE(NULLIF(alias_cn_2, ''), NULLIF(%s, ''), alias_cn_2),
+                    alias_cn_3 = COALESCE(NULLIF(alias_cn_3, ''), NULLIF(%s, ''), alias_cn_3)
+                WHERE anime_id = %s
+            """, params)
+            if affected_rows > 0:
+                _bump_library_version()
+                logging.info(f"为作品 ID {anime_id} 更新了别名字段。")
 
-            updates, params = [], []
-            if not current.get('name_en') and aliases.get('name_en'):
-                updates.append("name_en = %s"); params.append(aliases['name_en'])
-            if not current.get('name_jp') and aliases.get('name_jp'):
-                updates.append("name_jp = %s"); params.append(aliases['name_jp'])
-            if not current.get('name_romaji') and aliases.get('name_romaji'):
-                updates.append("name_romaji = %s"); params.append(aliases['name_romaji'])
-            
-            cn_aliases = aliases.get('aliases_cn', [])
-            if not current.get('alias_cn_1') and len(cn_aliases) > 0:
-                updates.append("alias_cn_1 = %s"); params.append(cn_aliases[0])
-            if not current.get('alias_cn_2') and len(cn_aliases) > 1:
-                updates.append("alias_cn_2 = %s"); params.append(cn_aliases[1])
-            if not current.get('alias_cn_3') and len(cn_aliases) > 2:
-                updates.append("alias_cn_3 = %s"); params.append(cn_aliases[2])
+# 定时任务的运行时间先记录在内存中，与任务历史一起由 flush_task_history_and_run_times 定期批量写入。
+# 读取时用内存中的值覆盖数据库中的值，保证调用方总能读到最新的运行时间。
+# task_id -> (last_run, next_run, task_id)
+_pending_run_times: Dict[str, Tuple[Optional[datetime], Optional[datetime], str]] = {}
 
-            if updates:
-                query = f"UPDATE anime_aliases SET {', '.join(updates)} WHERE anime_id = %s"
-                params.append(anime_id)
-                await cursor.execute(query, tuple(params))
-                logging.info(f"为作品 ID {anime_id} 更新了 {len(updates)} 个别名字段。")
+def _apply_pending_run_times(task: Dict[str, Any]) -> Dict[str, Any]:
+    if pending := _pending_run_times.get(task['id']):
+        task['last_run_at'], task['next_run_at'], _ = pending
+    return task
 
 async def get_scheduled_tasks(pool: aiomysql.Pool) -> List[Dict[str, Any]]:
     async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
             await cursor.execute("SELECT id, name, job_type, cron_expression, is_enabled, last_run_at, next_run_at FROM scheduled_tasks ORDER BY name")
-            return await cursor.fetchall()
+            return [_apply_pending_run_times(task) for task in await cursor.fetchall()]
 
 async def get_scheduled_task(pool: aiomysql.Pool, task_id: str) -> Optional[Dict[str, Any]]:
     async with pool.acquire() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
             await cursor.execute("SELECT id, name, job_type, cron_expression, is_enabled, last_run_at, next_run_at FROM scheduled_tasks WHERE id = %s", (task_id,))
-            return await cursor.fetchone()
+            task = await cursor.fetchone()
+            return _apply_pending_run_times(task) if task else None
 
 async def create_scheduled_task(pool: aiomysql.Pool, task_id: str, name: str, job_type: str, cron: str, is_enabled: bool):
     async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("INSERT INTO scheduled_tasks (id, name, job_type, cron_expression, is_enabled) VALUES (%s, %s, %s, %s, %s)", (task_id, name, job_type, cron, is_enabled))
+        await _exec_noresult(conn, "INSERT INTO scheduled_tasks (id, name, job_type, cron_expression, is_enabled) VALUES (%s, %s, %s, %s, %s)", (task_id, name, job_type, cron, is_enabled))
 
 async def update_scheduled_task(pool: aiomysql.Pool, task_id: str, name: str, cron: str, is_enabled: bool):
     async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("UPDATE scheduled_tasks SET name = %s, cron_expression = %s, is_enabled = %s WHERE id = %s", (name, cron, is_enabled, task_id))
+        await _exec_noresult(conn, "UPDATE scheduled_tasks SET name = %s, cron_expression = %s, is_enabled = %s WHERE id = %s", (name, cron, is_enabled, task_id))
 
 async def delete_scheduled_task(pool: aiomysql.Pool, task_id: str):
+    _pending_run_times.pop(task_id, None)
     async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute("DELETE FROM scheduled_tasks WHERE id = %s", (task_id,))
+        await _exec_noresult(conn, "DELETE FROM scheduled_tasks WHERE id = %s", (task_id,))
 
 async def update_scheduled_task_run_times(pool: aiomysql.Pool, task_id: str, last_run: Optional[datetime], next_run: Optional[datetime]):
+    """记录定时任务的运行时间。同一任务的多次更新会被合并，由 flush_task_history_and_run_times 批量写入。"""
+    _pending_run_times[task_id] = (last_run, next_run, task_id)
+
+_UPDATE_SCHEDULED_TASK_RUN_TIMES_SQL = "UPDATE scheduled_tasks SET last_run_at = %s, next_run_at = %s WHERE id = %s"
+
+async def update_many_scheduled_task_run_times(pool: aiomysql.Pool, rows: List[Tuple[Optional[datetime], Optional[datetime], str]]):
+    """在一个事务中批量更新多个定时任务的运行时间。rows 为 (last_run, next_run, task_id) 元组列表。"""
+    if not rows:
+        return
     async with pool.acquire() as conn:
         async with conn.cursor() as cursor:
-            await cursor.execute("UPDATE scheduled_tasks SET last_run_at = %s, next_run_at = %s WHERE id = %s", (last_run, next_run, task_id))
+            try:
+                await conn.begin()
+                await cursor.executemany(_UPDATE_SCHEDULED_TASK_RUN_TIMES_SQL, rows)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
 
 # --- Task History ---
 
+# 任务历史的高频写入语句统一定义为模块级常量，所有调用方使用同一个字符串对象，
+# 保证发送到服务器的语句文本完全一致。
+_UPSERT_TASK_HISTORY_SQL = (
+    "INSERT INTO task_history (id, title, status, progress, description) VALUES (%s, %s, %s, %s, %s) AS new_values "
+    "ON DUPLICATE KEY UPDATE status = new_values.status, progress = new_values.progress, description = new_values.description"
+)
+# 进度是后写的，可能在任务结束之后才被写入；finished_at 非空的记录已是最终状态，不再被进度覆盖
+_UPDATE_TASK_PROGRESS_SQL = "UPDATE task_history SET status = %s, progress = %s, description = %s WHERE id = %s AND finished_at IS NULL"
+_FINALIZE_TASK_SQL = "UPDATE task_history SET status = %s, description = %s, progress = 100, finished_at = %s WHERE id = %s"
+_UPDATE_TASK_STATUS_SQL = "UPDATE task_history SET status = %s WHERE id = %s"
+
+async def upsert_task_history(pool: aiomysql.Pool, task_id: str, title: str, status: str, progress: int, description: str):
+    """创建一条任务记录；如果记录已存在，则在同一条语句中更新其状态、进度和描述。"""
+    async with pool.acquire() as conn:
+        await _exec_noresult(conn, _UPSERT_TASK_HISTORY_SQL, (task_id, title, status, progress, description))
+
+# 任务历史采用后写 (write-behind) 方式：创建和进度更新先记录在内存中，
+# 由 flush_task_history_and_run_times 定期批量写入，调用方无需等待数据库往返。
+# 待写入的任务创建记录
+_pending_task_creations: Dict[str, tuple] = {}
+# 待写入的任务进度，按 task_id 合并，只保留最新一次更新
+_pending_task_progress: Dict[str, tuple] = {}
+# 批量写入与直接写入 (结束任务、更新状态、删除任务) 互斥执行：批量写入会先取出待写入的记录再等待数据库，
+# 若期间有直接写入先行提交，旧的记录随后写入就会覆盖它 (例如把已完成的任务改回运行中)。
+_task_history_write_lock = asyncio.Lock()
+
 async def create_task_in_history(pool: aiomysql.Pool, task_id: str, title: str, status: str, description: str):
-    """在 task_history 表中创建一条新的任务记录。"""
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute(
-                "INSERT INTO task_history (id, title, status, description) VALUES (%s, %s, %s, %s)",
-                (task_id, title, status, description)
-            )
+    """在 task_history 表中创建一条新的任务记录。记录由 flush_task_history_and_run_times 批量写入。"""
+    _pending_task_creations[task_id] = (task_id, title, status, 0, description)
+
+async def _ensure_task_created(pool: aiomysql.Pool, task_id: str):
+    """如果任务的创建记录仍在等待写入，则立即写入，以便后续的直接更新能命中该记录。"""
+    row = _pending_task_creations.pop(task_id, None)
+    if row:
+        await upsert_task_history(pool, *row)
 
 async def update_task_progress_in_history(pool: aiomysql.Pool, task_id: str, status: str, progress: int, description: str):
-    """更新任务历史记录中的进度和状态。"""
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute(
-                "UPDATE task_history SET status = %s, progress = %s, description = %s WHERE id = %s",
-                (status, progress, description, task_id)
-            )
+    """更新任务历史记录中的进度和状态。同一任务的频繁更新会被合并，由 flush_task_history_and_run_times 批量写入。"""
+    _pending_task_progress[task_id] = (status, progress, description, task_id)
+
+def _take_pending_task_history() -> Tuple[List[tuple], List[tuple]]:
+    """取出所有待写入的任务创建记录和任务进度。"""
+    creations = list(_pending_task_creations.values())
+    progress_rows = list(_pending_task_progress.values())
+    _pending_task_creations.clear()
+    _pending_task_progress.clear()
+    return creations, progress_rows
+
+def _restore_pending_task_history(creations: List[tuple], progress_rows: List[tuple]):
+    """写入失败时放回 (不覆盖期间产生的更新的记录)，等待下一次刷新。"""
+    for row in creations:
+        _pending_task_creations.setdefault(row[0], row)
+    for row in progress_rows:
+        _pending_task_progress.setdefault(row[3], row)
+
+def _take_pending_run_times() -> List[tuple]:
+    """取出所有待写入的定时任务运行时间。"""
+    rows = list(_pending_run_times.values())
+    _pending_run_times.clear()
+    return rows
+
+def _restore_pending_run_times(rows: List[tuple]):
+    """写入失败时放回 (不覆盖期间产生的更新的记录)，等待下一次刷新。"""
+    for row in rows:
+        _pending_run_times.setdefault(row[2], row)
+
+async def _executemany_in_savepoint(cursor: aiomysql.Cursor, savepoint: str, batches: List[Tuple[str, List[tuple]]]):
+    """在事务内的保存点中依次执行多组 executemany；失败时只回滚到该保存点，事务中的其他写入不受影响。"""
+    if not any(rows for _, rows in batches):
+        return
+    await cursor.execute(f"SAVEPOINT {savepoint}")
+    try:
+        for query, rows in batches:
+            if rows:
+                await cursor.executemany(query, rows)
+    except Exception:
+        await cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+        raise
+
+async def flush_task_history_and_run_times(pool: aiomysql.Pool) -> int:
+    """
+    任务历史与定时任务运行时间共用的后写刷新：两者的待写入记录通过同一个连接、在同一个事务中写入，
+    使定时任务结束时的多处状态变更只产生一次提交。
+    两部分各自位于一个保存点中，一部分写入失败只回滚并放回该部分的记录，另一部分照常提交。
+    返回写入的记录数。
+    """
+    async with _task_history_write_lock:
+        creations, progress_rows = _take_pending_task_history()
+        run_time_rows = _take_pending_run_times()
+        if not creations and not progress_rows and not run_time_rows:
+            return 0
+
+        history_written = run_times_written = False
+        part_error = None
+        try:
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    try:
+                        await conn.begin()
+                        try:
+                            # 先创建记录，再更新进度
+                            await _executemany_in_savepoint(cursor, "task_history", [
+                                (_UPSERT_TASK_HISTORY_SQL, creations),
+                                (_UPDATE_TASK_PROGRESS_SQL, progress_rows),
+                            ])
+                            history_written = True
+                        except Exception as e:
+                            part_error = e
+                        try:
+                            await _executemany_in_savepoint(cursor, "run_times", [
+                                (_UPDATE_SCHEDULED_TASK_RUN_TIMES_SQL, run_time_rows),
+                            ])
+                            run_times_written = True
+                        except Exception as e:
+                            part_error = part_error or e
+                        await conn.commit()
+                    except Exception:
+                        await conn.rollback()
+                        raise
+        except Exception:
+            # 连接或提交失败时整个事务都未生效，两部分都需放回
+            history_written = run_times_written = False
+            raise
+        finally:
+            if not history_written:
+                _restore_pending_task_history(creations, progress_rows)
+            if not run_times_written:
+                _restore_pending_run_times(run_time_rows)
+
+        if creations and history_written:
+            _invalidate_task_history_cache()
+        if part_error:
+            raise part_error
+        return len(creations) + len(progress_rows) + len(run_time_rows)
 
 async def finalize_task_in_history(pool: aiomysql.Pool, task_id: str, status: str, description: str):
     """标记任务为最终状态（完成或失败）并记录完成时间。"""
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute(
-                "UPDATE task_history SET status = %s, description = %s, progress = 100, finished_at = NOW() WHERE id = %s",
-                (status, description, task_id)
-            )
+    async with _task_history_write_lock:
+        # 丢弃尚未写入的进度，避免其在最终状态之后写入而覆盖最终状态
+        _pending_task_progress.pop(task_id, None)
+        await _ensure_task_created(pool, task_id)
+        async with pool.acquire() as conn:
+            await _exec_noresult(conn, _FINALIZE_TASK_SQL, (status, description, datetime.now(), task_id))
+    _invalidate_task_history_cache()
 
 async def update_task_status(pool: aiomysql.Pool, task_id: str, status: str):
     """仅更新任务的状态，不改变进度和描述。"""
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            await cursor.execute(
-                "UPDATE task_history SET status = %s WHERE id = %s", (status, task_id)
-            )
-
-async def get_tasks_from_history(pool: aiomysql.Pool, search_term: Optional[str], status_filter: str) -> List[Dict[str, Any]]:
-    """从数据库获取任务历史记录，支持搜索和过滤。"""
-    query = "SELECT id as task_id, title, status, progress, description, created_at FROM task_history"
-    conditions, params = [], []
-
+    async with _task_history_write_lock:
+        # 同步修改尚未写入的进度中的状态，避免其在之后写入时覆盖本次状态
+        if task_id in _pending_task_progress:
+            _, progress, description, _ = _pending_task_progress[task_id]
+            _pending_task_progress[task_id] = (status, progress, description, task_id)
+        await _ensure_task_created(pool, task_id)
+        async with pool.acquire() as conn:
+            await _exec_noresult(conn, _UPDATE_TASK_STATUS_SQL, (status, task_id))
+    _invalidate_task_history_cache()
+
+# 任务列表的短时缓存：管理界面会频繁轮询，相同条件的查询在 TTL 内只访问一次数据库。
+# 缓存值为查询的 Future，并发的相同请求会等待同一次查询 (请求合并)。
+_TASK_HISTORY_CACHE_TTL = 0.5
+_TASK_HISTORY_CACHE_MAXSIZE = 64
+_task_history_cache: Dict[Tuple[str, str, int], Tuple[float, asyncio.Future]] = {}
+
+def _invalidate_task_history_cache():
+    """清空任务列表缓存。在任务被创建、结束、暂停/恢复或删除时调用。"""
+    _task_history_cache.clear()
+
+# 任务列表查询的所有可能形态在导入时预先生成，调用时只需按条件查表，
+# 无需每次拼接 SQL；同一形态的语句字节完全一致。
+# 键: (是否带游标, 搜索方式 None/'fulltext'/'like', 状态过滤 'all'/'in_progress'/'completed')
+_TASK_HISTORY_SEARCH_CONDITIONS = {
+    None: None,
+    # 使用 ngram FULLTEXT 索引进行短语匹配。它与子串匹配并不等价：InnoDB 默认停用词表 (英文单词)
+    # 会使含停用词的 ngram 分词 (如 "Import" 中的 "or") 无法命中，布尔模式的运算符字符也须先清理掉。
+    # 因此只对不含这些字符的非 ASCII 字母搜索词使用，且没有结果时回退到 LIKE (见 _fetch_tasks_from_history)
+    'fulltext': "MATCH(title) AGAINST(%s IN BOOLEAN MODE)",
+    'like': "title LIKE %s",
+}
+# 使用 status_code 生成列过滤 (见 database.TASK_STATUS_CODE_COLUMN)
+_TASK_HISTORY_STATUS_CONDITIONS = {
+    'all': None,
+    'in_progress': "status_code IN (0, 1, 4)", # 排队中, 运行中, 已暂停
+    'completed': "status_code = 2", # 已完成
+}
+
+def _compile_task_history_queries() -> Dict[Tuple[bool, Optional[str], str], str]:
+    # 描述需完整返回：前端原样展示，失败信息和错误堆栈没有其他接口可以查看
+    base = "SELECT id as task_id, title, status, progress, description, created_at FROM task_history"
+    queries = {}
+    for has_after in (False, True):
+        for search_mode, search_condition in _TASK_HISTORY_SEARCH_CONDITIONS.items():
+            for status_filter, status_condition in _TASK_HISTORY_STATUS_CONDITIONS.items():
+                conditions = [c for c in (
+                    "(created_at, id) < (%s, %s)" if has_after else None, search_condition, status_condition
+                ) if c]
+                query = base
+                if conditions:
+                    query += " WHERE " + " AND ".join(conditions)
+                query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+                queries[(has_after, search_mode, status_filter)] = query
+    return queries
+
+_TASK_HISTORY_QUERIES = _compile_task_history_queries()
+# 与上面查询语句的列顺序一致，用于将元组行转换为字典
+_TASK_HISTORY_KEYS = ("task_id", "title", "status", "progress", "description", "created_at")
+
+# 任务列表每页的默认条数和上限
+TASK_HISTORY_PAGE_SIZE = 100
+TASK_HISTORY_MAX_PAGE_SIZE = 500
+
+# 布尔模式下有特殊含义的字符，以及可能命中英文停用词的 ASCII 字母
+_TASK_TITLE_FULLTEXT_UNSAFE_RE = re.compile(r'[+\-><()~*@"A-Za-z]')
+
+def _task_title_uses_fulltext(search_term: Optional[str]) -> bool:
+    """
+    搜索词能否用 FULLTEXT 短语匹配得到与 LIKE 子串匹配相同的结果：
+    至少 2 个字符 (ngram 默认分词长度)，且不含布尔运算符字符和 ASCII 字母。
+    """
+    if not search_term:
+        return False
+    term = search_term.strip()
+    return len(term) >= 2 and not _TASK_TITLE_FULLTEXT_UNSAFE_RE.search(term)
+
+def _build_task_history_query(
+    search_term: Optional[str], status_filter: str, after: Optional[Tuple[datetime, str]], limit: int,
+    use_fulltext: bool = True
+) -> Tuple[str, tuple]:
+    """从预生成的语句表中选出任务历史列表的查询语句，并组装参数。"""
+    params = list(after) if after else []
+    search_mode = None
     if search_term:
-        conditions.append("title LIKE %s")
-        params.append(f"%{search_term}%")
-
-    if status_filter == 'in_progress':
-        conditions.append("status IN ('排队中', '运行中', '已暂停')")
-    elif status_filter == 'completed':
-        conditions.append("status = '已完成'")
-
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-    
-    query += " ORDER BY created_at DESC LIMIT 100"
-
+        if use_fulltext and _task_title_uses_fulltext(search_term):
+            search_mode = 'fulltext'
+            params.append(f'"{search_term.strip()}"')
+        else:
+            search_mode = 'like'
+            params.append(f"%{search_term}%")
+
+    if status_filter not in _TASK_HISTORY_STATUS_CONDITIONS:
+        status_filter = 'all'
+    params.append(limit)
+    return _TASK_HISTORY_QUERIES[(bool(after), search_mode, status_filter)], tuple(params)
+
+async def get_tasks_from_history(
+    pool: aiomysql.Pool, search_term: Optional[str], status_filter: str,
+    after: Optional[Tuple[datetime, str]] = None, limit: int = TASK_HISTORY_PAGE_SIZE
+) -> List[Dict[str, Any]]:
+    """
+    从数据库获取任务历史记录，支持搜索和过滤。
+    after: 可选的 (created_at, task_id) 游标，传入上一页最后一条记录的值即可获取下一页。
+    limit: 每页条数，不超过 TASK_HISTORY_MAX_PAGE_SIZE。
+    """
+    limit = max(1, min(limit, TASK_HISTORY_MAX_PAGE_SIZE))
+    if after:
+        return await _fetch_tasks_from_history(pool, search_term, status_filter, after, limit)
+
+    # 第一页使用短时缓存；返回的列表在调用方之间共享，不应被修改
+    key = (search_term or '', status_filter, limit)
+    entry = _task_history_cache.get(key)
+    if entry is None or time.monotonic() - entry[0] >= _TASK_HISTORY_CACHE_TTL:
+        _task_history_cache.pop(key, None)
+        if len(_task_history_cache) >= _TASK_HISTORY_CACHE_MAXSIZE:
+            _task_history_cache.pop(next(iter(_task_history_cache)))
+        future = asyncio.ensure_future(_fetch_tasks_from_history(pool, search_term, status_filter, None, limit))
+        entry = (time.monotonic(), future)
+        _task_history_cache[key] = entry
+    try:
+        # shield: 某个调用方被取消时，不影响正在等待同一查询的其他调用方
+        return await asyncio.shield(entry[1])
+    except Exception:
+        if _task_history_cache.get(key) is entry:
+            del _task_history_cache[key]
+        raise
+
+async def _fetch_tasks_from_history(
+    pool: aiomysql.Pool, search_term: Optional[str], status_filter: str, after: Optional[Tuple[datetime, str]], limit: int
+) -> List[Dict[str, Any]]:
+    query, params = _build_task_history_query(search_term, status_filter, after, limit)
     async with pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            await cursor.execute(query, tuple(params))
-            return await cursor.fetchall()
+        async with conn.cursor() as cursor:
+            await cursor.execute(query, params)
+            rows = await cursor.fetchall()
+            if not rows and _task_title_uses_fulltext(search_term):
+                # FULLTEXT 没有结果时 (例如分词被停用词过滤)，用 LIKE 子串匹配重试一次
+                query, params = _build_task_history_query(search_term, status_filter, after, limit, use_fulltext=False)
+                await cursor.execute(query, params)
+                rows = await cursor.fetchall()
+    return [dict(zip(_TASK_HISTORY_KEYS, row)) for row in rows]
 
 async def get_task_from_history_by_id(pool: aiomysql.Pool, task_id: str) -> Optional[Dict[str, Any]]:
     """从数据库获取单个任务历史记录。"""
@@ -1376,9 +1994,34 @@ async def get_task_from_history_by_id(pool: aiomysql.Pool, task_id: str) -> Opti
             await cursor.execute("SELECT id, title, status FROM task_history WHERE id = %s", (task_id,))
             return await cursor.fetchone()
 
+async def delete_old_task_history(pool: aiomysql.Pool, before: datetime, batch_size: int = 5000) -> int:
+    """
+    分批删除创建时间早于 before 的已结束 (已完成/失败) 任务记录，返回删除的总行数。
+    每批为一个独立的短语句，避免单条大 DELETE 长时间持有锁。
+    """
+    total = 0
+    while True:
+        async with pool.acquire() as conn:
+            deleted = await _exec_noresult(
+                conn,
+                "DELETE FROM task_history WHERE created_at < %s AND status_code IN (2, 3) ORDER BY created_at LIMIT %s",
+                (before, batch_size)
+            )
+        total += deleted
+        if deleted < batch_size:
+            break
+    if total:
+        _invalidate_task_history_cache()
+    return total
+
 async def delete_task_from_history(pool: aiomysql.Pool, task_id: str) -> bool:
     """从 task_history 表中删除一个任务记录。"""
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cursor:
-            affected_rows = await cursor.execute("DELETE FROM task_history WHERE id = %s", (task_id,))
-            return affected_rows > 0
+    async with _task_history_write_lock:
+        # 同时丢弃尚未写入的创建记录和进度，避免已删除的任务在下一次批量写入时被重新插入
+        created = _pending_task_creations.pop(task_id, None) is not None
+        _pending_task_progress.pop(task_id, None)
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                affected_rows = await cursor.execute("DELETE FROM task_history WHERE id = %s", (task_id,))
+    _invalidate_task_history_cache()
+    return created or affected_rows > 0
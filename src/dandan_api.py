@@ -1,16 +1,17 @@
 import asyncio
+import functools
 import logging
-import json
 import re
-from typing import List, Optional, Dict, Any
+import time
+from typing import Awaitable, List, NamedTuple, Optional, Dict, Any, Tuple
 from typing import Callable
 from datetime import datetime
 from opencc import OpenCC
 
 import aiomysql
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status, Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.routing import APIRoute
 
 from . import crud, models
@@ -19,17 +20,36 @@ from .database import get_db_pool
 logger = logging.getLogger(__name__)
 
 # --- Module-level Constants for Type Mappings ---
-# To avoid repetition and improve maintainability.
-DANDAN_TYPE_MAPPING = {
-    "tv_series": "tvseries", "movie": "movie", "ova": "ova", "other": "other"
-}
-DANDAN_TYPE_DESC_MAPPING = {
-    "tv_series": "TV动画", "movie": "电影/剧场版", "ova": "OVA", "other": "其他"
+# 库中类型 -> (dandanplay 类型, 类型描述)，一次查找同时得到两者
+_TYPE_PAIR = {
+    "tv_series": ("tvseries", "TV动画"),
+    "movie": ("movie", "电影/剧场版"),
+    "ova": ("ova", "OVA"),
+    "other": ("other", "其他"),
 }
+_DEFAULT_TYPE_PAIR = _TYPE_PAIR["other"]
+
+def _map_type(res_type: Optional[str]) -> Tuple[str, str]:
+    """将库中的作品类型映射为 dandanplay 的 (type, typeDescription)。"""
+    return _TYPE_PAIR.get(res_type, _DEFAULT_TYPE_PAIR)
 
 # 这个子路由将包含所有接口的实际实现。
 # 它将被挂载到主路由的不同路径上。
-implementation_router = APIRouter()
+# 所有接口默认使用 orjson 序列化响应，比标准库 json 快得多，对分集和弹幕列表这类大响应尤其明显。
+implementation_router = APIRouter(default_response_class=ORJSONResponse)
+
+# 简单的 HTTP 状态码到 dandanplay 错误码的映射
+# 1001: 无效的参数
+# 1003: 未授权
+# 404: 未找到
+# 500: 服务器内部错误
+_ERROR_CODE_MAP = {
+    status.HTTP_400_BAD_REQUEST: 1001,
+    status.HTTP_404_NOT_FOUND: 404,
+    status.HTTP_422_UNPROCESSABLE_ENTITY: 1001,
+    status.HTTP_403_FORBIDDEN: 1003,
+    status.HTTP_500_INTERNAL_SERVER_ERROR: 500,
+}
 
 class DandanApiRoute(APIRoute):
     """
@@ -43,22 +63,10 @@ class DandanApiRoute(APIRoute):
             try:
                 return await original_route_handler(request)
             except HTTPException as exc:
-                # 简单的 HTTP 状态码到 dandanplay 错误码的映射
-                # 1001: 无效的参数
-                # 1003: 未授权
-                # 404: 未找到
-                # 500: 服务器内部错误
-                error_code_map = {
-                    status.HTTP_400_BAD_REQUEST: 1001,
-                    status.HTTP_404_NOT_FOUND: 404,
-                    status.HTTP_422_UNPROCESSABLE_ENTITY: 1001,
-                    status.HTTP_403_FORBIDDEN: 1003,
-                    status.HTTP_500_INTERNAL_SERVER_ERROR: 500,
-                }
-                error_code = error_code_map.get(exc.status_code, 500)
+                error_code = _ERROR_CODE_MAP.get(exc.status_code, 500)
 
                 # 始终返回 200 OK，错误信息在 JSON body 中体现
-                return JSONResponse(
+                return ORJSONResponse(
                     status_code=status.HTTP_200_OK,
                     content={
                         "success": False,
@@ -68,6 +76,14 @@ class DandanApiRoute(APIRoute):
                 )
         return custom_route_handler
 
+def _dandan_response(model: BaseModel) -> ORJSONResponse:
+    """
+    将已构建好的响应模型直接序列化为响应。
+    路由处理函数返回 Response 对象时，FastAPI 会跳过按 response_model 进行的二次校验和序列化，
+    response_model 仍保留在路由上用于生成 OpenAPI 文档。
+    """
+    return ORJSONResponse(model.model_dump())
+
 # 这是将包含在 main.py 中的主路由。
 # 使用自定义的 Route 类来应用特殊的异常处理。
 dandan_router = APIRouter(route_class=DandanApiRoute)
@@ -217,6 +233,43 @@ class DandanBatchMatchRequestItem(BaseModel):
 class DandanBatchMatchRequest(BaseModel):
     requests: List[DandanBatchMatchRequestItem]
 
+# /match 和 /match/batch 的请求体直接从原始字节解析和校验 (单次解析，不经过中间的 dict)
+_MATCH_ITEM_ADAPTER = TypeAdapter(DandanBatchMatchRequestItem)
+_BATCH_MATCH_ADAPTER = TypeAdapter(DandanBatchMatchRequest)
+
+def _inline_schema_refs(schema: Any, defs: Dict[str, Any]) -> Any:
+    """将 JSON Schema 中指向 $defs 的引用替换为其定义本身。"""
+    if isinstance(schema, dict):
+        if "$ref" in schema:
+            return _inline_schema_refs(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+        return {k: _inline_schema_refs(v, defs) for k, v in schema.items() if k != "$defs"}
+    if isinstance(schema, list):
+        return [_inline_schema_refs(v, defs) for v in schema]
+    return schema
+
+def _request_body_openapi(adapter: TypeAdapter) -> Dict[str, Any]:
+    """为手动解析请求体的路由生成 OpenAPI 的 requestBody 描述。"""
+    schema = adapter.json_schema()
+    return {"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": _inline_schema_refs(schema, schema.get("$defs", {}))}},
+    }}
+
+async def _parse_request_body(request: Request, adapter: TypeAdapter) -> Any:
+    """读取原始请求体并用 adapter 解析校验。校验失败时以 dandanplay 的错误格式返回。"""
+    try:
+        return adapter.validate_json(await request.body())
+    except ValidationError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid request body: {e.errors()[0]['msg']}")
+
+
+# 搜索结果的进程内短时缓存：播放器每切换一集都会用相同的标题重新搜索。
+# 缓存值为 (失效时间, 构建响应的 Future)，并发的相同搜索等待同一次查询。
+# 缓存键包含弹幕库版本号，导入、删除、重新关联等写操作后旧的缓存不再命中；
+# 很短的缓存时间作为兜底，覆盖未递增版本号的其他写入。
+_SEARCH_CACHE_TTL = 10.0
+_SEARCH_CACHE_MAXSIZE = 1024
+_search_cache: Dict[Tuple[int, str, Optional[int]], Tuple[float, asyncio.Future]] = {}
 
 async def _search_implementation(
     search_term: str,
@@ -231,109 +284,164 @@ async def _search_implementation(
             detail="Missing required query parameter: 'anime' or 'keyword'"
         )
 
-    episode_number = int(episode) if episode and episode.isdigit() else None
+    # 只接受纯 ASCII 数字的正整数集数：int() 本身会放过 '-1'、'+5'、' 5 '、'1_0' 这类写法，
+    # 而单独的 isdigit() 又会放过 '²' 这类 int() 无法解析的字符
+    episode_number = None
+    if episode and episode.isascii() and episode.isdigit():
+        n = int(episode)
+        episode_number = n if n > 0 else None
     
-    flat_results = await crud.search_episodes_in_library(pool, search_term, episode_number)
-
-    grouped_animes: Dict[int, DandanAnimeInfo] = {}
-
-    for res in flat_results:
-        anime_id = res['animeId']
-        if anime_id not in grouped_animes:
-            dandan_type = DANDAN_TYPE_MAPPING.get(res.get('type'), "other")
-            dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(res.get('type'), "其他")
-
-            grouped_animes[anime_id] = DandanAnimeInfo(
-                bangumiId=res.get('bangumiId') or f"A{anime_id}",
-                animeId=anime_id,
-                animeTitle=res['animeTitle'],
-                type=dandan_type,
-                typeDescription=dandan_type_desc,
-                imageUrl=res.get('imageUrl'),
-                startDate=res.get('startDate'),
-                episodeCount=res.get('totalEpisodeCount', 0),
-                episodes=[]
-            )
-        
-        grouped_animes[anime_id].episodes.append(
-            DandanEpisodeInfo(episodeId=res['episodeId'], episodeTitle=res['episodeTitle'])
-        )
-    
-    return DandanSearchEpisodesResponse(animes=list(grouped_animes.values()))
+    key = (crud.get_library_version(), search_term, episode_number)
+    entry = _search_cache.get(key)
+    if entry is None or time.monotonic() >= entry[0]:
+        _search_cache.pop(key, None)
+        if len(_search_cache) >= _SEARCH_CACHE_MAXSIZE:
+            _search_cache.pop(next(iter(_search_cache)))
+        future = asyncio.ensure_future(_build_search_response(search_term, episode_number, pool))
+        entry = (time.monotonic() + _SEARCH_CACHE_TTL, future)
+        _search_cache[key] = entry
+    try:
+        # shield: 某个调用方被取消时，不影响正在等待同一查询的其他调用方
+        return await asyncio.shield(entry[1])
+    except Exception:
+        if _search_cache.get(key) is entry:
+            del _search_cache[key]
+        raise
+
+async def _build_search_response(
+    search_term: str,
+    episode_number: Optional[int],
+    pool: aiomysql.Pool
+) -> DandanSearchEpisodesResponse:
+    """查询弹幕库并构建搜索响应。"""
+    # 数据库已按番剧分组，每行即一个番剧及其匹配的分集列表；数据可信，构建模型时跳过校验
+    anime_rows = await crud.search_animes_with_episodes_in_library(pool, search_term, episode_number)
 
-def _parse_filename_for_match(filename: str) -> Optional[Dict[str, Any]]:
+    animes = []
+    for res in anime_rows:
+        dandan_type, dandan_type_desc = _map_type(res.get('type'))
+        animes.append(DandanAnimeInfo.model_construct(
+            bangumiId=res['bangumiId'],
+            animeId=res['animeId'],
+            animeTitle=res['animeTitle'],
+            type=dandan_type,
+            typeDescription=dandan_type_desc,
+            imageUrl=res.get('imageUrl'),
+            startDate=res.get('startDate'),
+            episodeCount=res.get('totalEpisodeCount', 0),
+            episodes=[DandanEpisodeInfo.model_construct(**ep) for ep in res['episodes']]
+        ))
+
+    return DandanSearchEpisodesResponse.model_construct(animes=animes)
+
+# --- 文件名解析使用的正则表达式，在模块导入时编译一次 ---
+# 模式1: SXXEXX 格式 (e.g., "Some.Anime.S01E02.1080p.mkv") 由 _scan_season_episode 解析
+# 模式2: 只有集数 (e.g., "[Subs] Some Anime - 02 [1080p].mkv")，只匹配数字和分隔符，无需 re.IGNORECASE
+_EP_ONLY_PATTERNS = (
+    re.compile(r"^(?P<title>.+?)\s*[-_]\s*\b(?P<episode>\d{1,4})\b"),
+    re.compile(r"^(?P<title>.+?)\s+\b(?P<episode>\d{1,4})\b"),
+)
+_SUB_GROUP_RE = re.compile(r'\[.*?\]')
+# 括号内的标签 (字幕组、分辨率等) 和常见的编码/画质/语言标记合并为一个模式，一次扫描全部移除
+_JUNK_RE = re.compile(
+    r'\[.*?\]|\(.*?\)|\【.*?\】'
+    r'|1080p|720p|4k|bluray|x264|h\s*\.?\s*264|hevc|x265|h\s*\.?\s*265|aac|flac|web-dl|BDRip|WEBRip|TVRip|DVDrip|AVC|CHT|CHS|BIG5|GB',
+    re.IGNORECASE
+)
+_YEAR_RE = re.compile(r'\b(19|20)\d{2}\b')
+_PAREN_YEAR_RE = re.compile(r'\(\s*(19|20)\d{2}\s*\)')
+_WHITESPACE_RE = re.compile(r'\s+')
+# 将文件名中的 '.' 和 '_' 分隔符替换为空格
+_SEPARATOR_TO_SPACE = str.maketrans({'.': ' ', '_': ' '})
+# 标题严格比较前的规范化：全角冒号转半角并去除空格，规则同库内 LIKE 回退搜索，另外也去除全角空格
+_NORMALIZE_TABLE = str.maketrans({'：': ':', ' ': None, '\u3000': None})
+
+# SXXEXX 的核心部分 (不含标题)，标题由 _scan_season_episode 根据匹配位置切出。
+# 字母已用 [Ss]/[Ee] 显式覆盖大小写，无需 re.IGNORECASE
+_SE_CORE_RE = re.compile(r"[Ss](?P<season>\d{1,2})[Ee](?P<episode>\d{1,4})\b")
+_SE_SEPARATORS = '._-'
+
+def _scan_season_episode(name: str) -> Optional[Tuple[str, str, str]]:
     """
-    使用正则表达式从文件名中解析出番剧标题和集数。
+    解析 SXXEXX 格式，语义与正则
+    ``^(?P<title>.+?)[\s._-]*[Ss](?P<season>\d{1,2})[Ee](?P<episode>\d{1,4})\b`` 完全一致。
+    该正则以惰性的标题开头，未匹配时会在每个位置重试整个模式；这里只用核心部分做一次
+    非锚定扫描，再手动切出标题，对不含 SXXEXX 的文件名 (最常见的情况) 快得多。
+    返回 (标题, 季度数字, 集数数字)，未匹配时返回 None。
+    """
+    # 标题至少一个字符，'S' 不能出现在开头
+    match = _SE_CORE_RE.search(name, 1)
+    if match is None:
+        return None
+    # 标题为 'S' 之前、去掉末尾分隔符的部分 (至少保留一个字符)
+    t = match.start()
+    while t > 1 and (name[t - 1] in _SE_SEPARATORS or name[t - 1].isspace()):
+        t -= 1
+    title = name[:t]
+    if '\n' in title:
+        # 正则中的 '.' 不匹配换行符，更靠后的位置也不可能匹配
+        return None
+    return title, match.group('season'), match.group('episode')
+
+class ParsedFilename(NamedTuple):
+    """文件名解析结果。season 为 None 表示无法从文件名中识别季度。"""
+    title: str
+    season: Optional[int]
+    episode: int
+
+# 客户端经常重复探测同一文件名 (同一季的批量匹配、拖动进度条后重新匹配)，
+# 解析是纯函数，结果为不可变的 ParsedFilename，可以安全地缓存。
+@functools.lru_cache(maxsize=4096)
+def _parse_filename_for_match(filename: str) -> Optional[ParsedFilename]:
+    """
+    从文件名中解析出番剧标题和集数。
     这是一个简化的实现，用于 dandanplay 兼容接口。
     """
     # 移除文件扩展名
-    name_without_ext = filename.rsplit('.', 1)[0] if '.' in filename else filename
-
-    # 模式1: SXXEXX 格式 (e.g., "Some.Anime.S01E02.1080p.mkv")
-    s_e_pattern = re.compile(
-        r"^(?P<title>.+?)"
-        r"[\s._-]*"
-        r"[Ss](?P<season>\d{1,2})"
-        r"[Ee](?P<episode>\d{1,4})"
-        r"\b",
-        re.IGNORECASE
-    )
-    match = s_e_pattern.search(name_without_ext)
-    if match:
-        data = match.groupdict()
-        title = data["title"].replace(".", " ").replace("_", " ").strip()
-        title = re.sub(r'\[.*?\]', '', title).strip() # 移除字幕组标签
+    head, sep, _ = filename.rpartition('.')
+    name_without_ext = head if sep else filename
+
+    # 模式1: SXXEXX 格式
+    season_episode = _scan_season_episode(name_without_ext)
+    if season_episode:
+        raw_title, season, episode = season_episode
+        title = raw_title.translate(_SEPARATOR_TO_SPACE).strip()
+        title = _SUB_GROUP_RE.sub('', title).strip() # 移除字幕组标签
         # 新增：移除标题中的年份并清理多余空格
-        title = re.sub(r'\b(19|20)\d{2}\b', '', title).strip()
-        title = re.sub(r'\s+', ' ', title).strip(' -')
-        return {
-            "title": title,
-            "season": int(data["season"]),
-            "episode": int(data["episode"])
-        }
-
-    # 模式2: 只有集数 (e.g., "[Subs] Some Anime - 02 [1080p].mkv")
-    ep_only_patterns = [
-        re.compile(r"^(?P<title>.+?)\s*[-_]\s*\b(?P<episode>\d{1,4})\b", re.IGNORECASE),
-        re.compile(r"^(?P<title>.+?)\s+\b(?P<episode>\d{1,4})\b", re.IGNORECASE),
-    ]
-    for pattern in ep_only_patterns:
+        title = _YEAR_RE.sub('', title).strip()
+        title = _WHITESPACE_RE.sub(' ', title).strip(' -')
+        return ParsedFilename(title, int(season), int(episode))
+
+    # 模式2: 只有集数
+    for pattern in _EP_ONLY_PATTERNS:
         match = pattern.search(name_without_ext)
         if match:
             data = match.groupdict()
             title = data["title"]
             # 清理标题中的元数据
-            title = re.sub(r'\[.*?\]|\(.*?\)|\【.*?\】', '', title).strip()
-            title = re.sub(r'1080p|720p|4k|bluray|x264|h\s*\.?\s*264|hevc|x265|h\s*\.?\s*265|aac|flac|web-dl|BDRip|WEBRip|TVRip|DVDrip|AVC|CHT|CHS|BIG5|GB', '', title, flags=re.IGNORECASE).strip()
-            title = title.replace("_", " ").replace(".", " ").strip()
+            title = _JUNK_RE.sub('', title).strip()
+            title = title.translate(_SEPARATOR_TO_SPACE).strip()
             # 新增：移除标题中的年份并清理多余空格
-            title = re.sub(r'\b(19|20)\d{2}\b', '', title).strip()
-            title = re.sub(r'\s+', ' ', title).strip(' -')
-            return {
-                "title": title,
-                "season": None, # 此模式无法识别季度
-                "episode": int(data["episode"]),
-            }
+            title = _YEAR_RE.sub('', title).strip()
+            title = _WHITESPACE_RE.sub(' ', title).strip(' -')
+            return ParsedFilename(title, None, int(data["episode"])) # 此模式无法识别季度
     
     # 模式3: 电影或单文件视频 (没有集数)
     title = name_without_ext
-    title = re.sub(r'\[.*?\]|\(.*?\)|\【.*?\】', '', title).strip()
-    title = re.sub(r'1080p|720p|4k|bluray|x264|h\s*\.?\s*264|hevc|x265|h\s*\.?\s*265|aac|flac|web-dl|BDRip|WEBRip|TVRip|DVDrip|AVC|CHT|CHS|BIG5|GB', '', title, flags=re.IGNORECASE).strip()
-    title = title.replace("_", " ").replace(".", " ").strip()
+    title = _JUNK_RE.sub('', title).strip()
+    title = title.translate(_SEPARATOR_TO_SPACE).strip()
     # 移除年份, 兼容括号内和独立两种形式
-    title = re.sub(r'\(\s*(19|20)\d{2}\s*\)', '', title).strip()
-    title = re.sub(r'\b(19|20)\d{2}\b', '', title).strip()
-    title = re.sub(r'\s+', ' ', title).strip(' -')
+    title = _PAREN_YEAR_RE.sub('', title).strip()
+    title = _YEAR_RE.sub('', title).strip()
+    title = _WHITESPACE_RE.sub(' ', title).strip(' -')
     
     if title:
-        return {
-            "title": title,
-            "season": 1, # 对电影，默认匹配第1季
-            "episode": 1, # 和第1集
-        }
+        return ParsedFilename(title, 1, 1) # 对电影，默认匹配第1季第1集
 
     return None
 
+# 访问日志中记录的路径去掉 /api/{token} 前缀
+_TOKEN_PREFIX_RE = re.compile(r'^/api/[^/]+')
 
 async def get_token_from_path(
     token: str = Path(..., description="路径中的API授权令牌"),
@@ -347,38 +455,32 @@ async def get_token_from_path(
     """
     # 1. 验证 token 是否存在、启用且未过期
     request_path = request.url.path
-    log_path = re.sub(r'^/api/[^/]+', '', request_path) # 从路径中移除 /api/{token} 部分
+    log_path = _TOKEN_PREFIX_RE.sub('', request_path) # 从路径中移除 /api/{token} 部分
 
+    # 令牌状态 (存在/启用/过期) 由一次查询给出，失败访问也无需再次查询即可记录
     token_info = await crud.validate_api_token(pool, token)
-    if not token_info:
-        # 尝试记录失败的访问
-        token_record = await crud.get_api_token_by_token_str(pool, token)
-        if token_record:
-            is_expired = token_record.get('expires_at') and token_record['expires_at'].replace(tzinfo=timezone.utc) < datetime.now(timezone.utc)
-            status_to_log = 'denied_expired' if is_expired else 'denied_disabled'
-            await crud.create_token_access_log(pool, token_record['id'], request.client.host, request.headers.get("user-agent"), log_status=status_to_log, path=log_path)
+    if not token_info or token_info['status'] != 'allowed':
+        if token_info:
+            crud.create_token_access_log(token_info['id'], request.client.host, request.headers.get("user-agent"), log_status=token_info['status'], path=log_path)
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid API token")
 
     # 2. UA 过滤
-    ua_filter_mode = await crud.get_config_value(pool, 'ua_filter_mode', 'off')
+    ua_filter_mode, ua_matcher = await crud.get_ua_policy(pool)
     user_agent = request.headers.get("user-agent", "")
 
     if ua_filter_mode != 'off':
-        ua_rules = await crud.get_ua_rules(pool)
-        ua_list = [rule['ua_string'] for rule in ua_rules]
-        
-        is_matched = any(rule in user_agent for rule in ua_list)
+        is_matched = ua_matcher is not None and ua_matcher.search(user_agent) is not None
 
         if ua_filter_mode == 'blacklist' and is_matched:
-            await crud.create_token_access_log(pool, token_info['id'], request.client.host, user_agent, log_status='denied_ua_blacklist', path=log_path)
+            crud.create_token_access_log(token_info['id'], request.client.host, user_agent, log_status='denied_ua_blacklist', path=log_path)
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User-Agent is blacklisted")
         
         if ua_filter_mode == 'whitelist' and not is_matched:
-            await crud.create_token_access_log(pool, token_info['id'], request.client.host, user_agent, log_status='denied_ua_whitelist', path=log_path)
+            crud.create_token_access_log(token_info['id'], request.client.host, user_agent, log_status='denied_ua_whitelist', path=log_path)
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User-Agent not in whitelist")
 
     # 3. 记录成功访问
-    await crud.create_token_access_log(pool, token_info['id'], request.client.host, user_agent, log_status='allowed', path=log_path)
+    crud.create_token_access_log(token_info['id'], request.client.host, user_agent, log_status='allowed', path=log_path)
 
     return token
 
@@ -398,7 +500,7 @@ async def search_episodes_for_dandan(
     它会搜索 **本地弹幕库** 中的番剧和分集信息。
     """
     search_term = anime.strip()
-    return await _search_implementation(search_term, episode, pool)
+    return _dandan_response(await _search_implementation(search_term, episode, pool))
 
 @implementation_router.get(
     "/search/anime",
@@ -427,12 +529,11 @@ async def search_anime_for_dandan(
     
     animes = []
     for res in db_results:
-        dandan_type = DANDAN_TYPE_MAPPING.get(res.get('type'), "other")
-        dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(res.get('type'), "其他")
+        dandan_type, dandan_type_desc = _map_type(res.get('type'))
 
-        animes.append(DandanSearchAnimeItem(
+        animes.append(DandanSearchAnimeItem.model_construct(
             animeId=res['animeId'],
-            bangumiId=res.get('bangumiId') or f"A{res['animeId']}",
+            bangumiId=res['bangumiId'],
             animeTitle=res['animeTitle'],
             type=dandan_type,
             typeDescription=dandan_type_desc,
@@ -444,7 +545,7 @@ async def search_anime_for_dandan(
             isFavorited=False  # 搜索结果默认不标记为收藏
         ))
     
-    return DandanSearchAnimeResponse(animes=animes)
+    return _dandan_response(DandanSearchAnimeResponse.model_construct(animes=animes))
 
 @implementation_router.get(
     "/bangumi/{bangumiId}",
@@ -471,39 +572,40 @@ async def get_bangumi_details(
 
 
     if anime_id_int is None:
-        return BangumiDetailsResponse(
+        return _dandan_response(BangumiDetailsResponse(
             success=True,
             bangumi=None,
             errorMessage=f"找不到与标识符 '{bangumiId}' 关联的作品。"
-        )
+        ))
 
     details = await crud.get_anime_details_for_dandan(pool, anime_id_int)
     if not details:
-        return BangumiDetailsResponse(
+        return _dandan_response(BangumiDetailsResponse(
             success=True,
             bangumi=None,
             errorMessage=f"在数据库中找不到ID为 {anime_id_int} 的作品详情。"
-        )
+        ))
 
     anime_data = details['anime']
     episodes_data = details['episodes']
 
-    dandan_type = DANDAN_TYPE_MAPPING.get(anime_data.get('type'), "other")
-    dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(anime_data.get('type'), "其他")
+    dandan_type, dandan_type_desc = _map_type(anime_data.get('type'))
 
+    # 分集数据来自数据库、类型已确定，跳过逐条校验 (可能有上千集)。
+    # episodeNumber 在库中是整数 (crud 也按它做数值排序)，这里再转为接口要求的字符串
+    construct_episode = BangumiEpisode.model_construct
     formatted_episodes = [
-        BangumiEpisode(
+        construct_episode(
             episodeId=ep['episodeId'],
             episodeTitle=ep['episodeTitle'],
             episodeNumber=str(ep['episodeNumber'])
         ) for ep in episodes_data
     ]
 
-    bangumi_id_str = anime_data.get('bangumiId') or f"A{anime_data['animeId']}"
-
-    bangumi_details = BangumiDetails(
+    # 整个详情对象 (包括上千集的分集列表) 都由可信的数据库数据构建，外层模型同样跳过校验
+    bangumi_details = BangumiDetails.model_construct(
         animeId=anime_data['animeId'],
-        bangumiId=bangumi_id_str,
+        bangumiId=anime_data['bangumiId'],
         animeTitle=anime_data['animeTitle'],
         imageUrl=anime_data.get('imageUrl'),
         searchKeyword=anime_data['animeTitle'],
@@ -514,83 +616,174 @@ async def get_bangumi_details(
         summary="暂无简介",
     )
 
-    return BangumiDetailsResponse(bangumi=bangumi_details)
+    return _dandan_response(BangumiDetailsResponse.model_construct(bangumi=bangumi_details))
 
-async def _process_single_batch_match(item: DandanBatchMatchRequestItem, pool: aiomysql.Pool) -> DandanMatchResponse:
-    """处理批量匹配中的单个文件，仅在精确匹配（1个结果）时返回成功。"""
-    parsed_info = _parse_filename_for_match(item.fileName)
-    if not parsed_info:
-        return DandanMatchResponse(isMatched=False)
+# 限制单个批量匹配项并发执行的 TMDB 映射查询数，避免一个 32 项的批量请求占满连接池
+_TMDB_LOOKUP_CONCURRENCY = 3
 
-    # --- 步骤 1: 尝试 TMDB 精确匹配 ---
-    potential_animes = await crud.find_animes_for_matching(pool, parsed_info["title"])
-    for anime in potential_animes:
-        if anime.get("tmdb_id") and anime.get("tmdb_episode_group_id"):
-            tmdb_results = await crud.find_episode_via_tmdb_mapping(
+async def _find_episodes_via_tmdb_candidates(
+    pool: aiomysql.Pool, potential_animes: List[Dict[str, Any]], parsed_info: ParsedFilename
+) -> List[Dict[str, Any]]:
+    """
+    并发地对所有带 TMDB 映射的候选作品执行映射查询，
+    按候选作品的原始顺序返回第一个非空的结果。
+    """
+    candidates = [a for a in potential_animes if a.get("tmdb_id") and a.get("tmdb_episode_group_id")]
+    if not candidates:
+        return []
+    semaphore = asyncio.Semaphore(_TMDB_LOOKUP_CONCURRENCY)
+
+    async def _lookup(anime: Dict[str, Any]) -> List[Dict[str, Any]]:
+        async with semaphore:
+            return await crud.find_episode_via_tmdb_mapping(
                 pool,
                 tmdb_id=anime["tmdb_id"],
                 group_id=anime["tmdb_episode_group_id"],
-                custom_season=parsed_info.get("season"),
-                custom_episode=parsed_info["episode"]
+                custom_season=parsed_info.season,
+                custom_episode=parsed_info.episode
             )
-            if tmdb_results:
-                # TMDB 映射是高置信度的，直接取第一个结果
-                res = tmdb_results[0]
-                dandan_type = DANDAN_TYPE_MAPPING.get(res.get('type'), "other")
-                dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(res.get('type'), "其他")
-                match = DandanMatchInfo(
-                    episodeId=res['episodeId'], animeId=res['animeId'], animeTitle=res['animeTitle'],
-                    episodeTitle=res['episodeTitle'], type=dandan_type, typeDescription=dandan_type_desc,
-                )
-                return DandanMatchResponse(isMatched=True, matches=[match])
 
-    # --- 步骤 2: 回退到旧的模糊搜索逻辑 ---
-    results = await crud.search_episodes_in_library(
-        pool, parsed_info["title"], parsed_info["episode"], parsed_info.get("season")
+    for tmdb_results in await asyncio.gather(*[_lookup(a) for a in candidates]):
+        if tmdb_results:
+            return tmdb_results
+    return []
+
+def _shared_lookup(
+    lookup_cache: Optional[Dict[tuple, asyncio.Future]], key: tuple, factory: Callable[[], Awaitable[Any]]
+) -> Awaitable[Any]:
+    """
+    在一次批量请求内合并相同参数的查询：同一个 key 只执行一次 factory()，其余调用方等待同一个结果。
+    lookup_cache 为 None 时直接执行查询。返回的结果在调用方之间共享，不应被修改。
+    """
+    if lookup_cache is None:
+        return factory()
+    if key not in lookup_cache:
+        lookup_cache[key] = asyncio.ensure_future(factory())
+    return lookup_cache[key]
+
+def _build_match_info(res: Dict[str, Any]) -> DandanMatchInfo:
+    """将一条分集查询结果转换为 DandanMatchInfo。数据来自数据库，使用 model_construct 跳过校验。"""
+    dandan_type, dandan_type_desc = _map_type(res.get('type'))
+    return DandanMatchInfo.model_construct(
+        episodeId=res['episodeId'],
+        animeId=res['animeId'],
+        animeTitle=res['animeTitle'],
+        episodeTitle=res['episodeTitle'],
+        type=dandan_type,
+        typeDescription=dandan_type_desc,
     )
 
-    # 优先处理被精确标记的源
-    favorited_results = [r for r in results if r.get('isFavorited')]
-    if favorited_results:
-        res = favorited_results[0]
-        dandan_type = DANDAN_TYPE_MAPPING.get(res.get('type'), "other")
-        dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(res.get('type'), "其他")
+async def _prefetch_batch_lookups(
+    pool: aiomysql.Pool, items: List[DandanBatchMatchRequestItem], lookup_cache: Dict[tuple, asyncio.Future]
+) -> None:
+    """
+    批量匹配前，将所有文件的候选作品查询和模糊搜索分别合并为批量查询执行，
+    结果以已完成的 Future 写入 lookup_cache，各项匹配时直接命中，不再逐项访问数据库。
+    """
+    parsed_items = [p for p in map(_parse_filename_for_match, (item.fileName for item in items)) if p]
+    if not parsed_items:
+        return
+    search_keys = [(p.title, p.episode, p.season) for p in parsed_items]
+    animes_by_title, episodes_by_key = await asyncio.gather(
+        crud.find_animes_for_matching_batch(pool, [p.title for p in parsed_items]),
+        crud.search_episodes_in_library_batch(pool, search_keys),
+    )
+    loop = asyncio.get_running_loop()
+
+    def _seed(key: tuple, value: Any) -> None:
+        future = loop.create_future()
+        future.set_result(value)
+        lookup_cache[key] = future
+
+    for title, animes in animes_by_title.items():
+        _seed(("find_animes", title), animes)
+    for key, results in episodes_by_key.items():
+        _seed(("search_episodes", *key), results)
+
+async def _process_single_batch_match(
+    item: DandanBatchMatchRequestItem,
+    pool: aiomysql.Pool,
+    lookup_cache: Optional[Dict[tuple, asyncio.Future]] = None,
+    return_ambiguous: bool = False
+) -> DandanMatchResponse:
+    """
+    匹配单个文件。优先使用 TMDB 映射进行精确匹配，失败则回退到标题模糊搜索。
+    lookup_cache: 可选，同一批量请求中的各项共享此字典，以避免重复执行相同的查询。
+    return_ambiguous: 为 False 时 (批量匹配) 仅在精确匹配（1个结果）时返回成功；
+        为 True 时 (/match) 会先按标题严格过滤模糊搜索结果，所有结果属于同一作品时也视为匹配成功，
+        匹配到多个不同作品时返回全部候选项供客户端选择。
+    """
+    parsed_info = _parse_filename_for_match(item.fileName)
+    logger.debug("文件名解析结果: %s", parsed_info)
+    if not parsed_info:
+        return DandanMatchResponse(isMatched=False)
 
-        match = DandanMatchInfo(
-            episodeId=res['episodeId'],
-            animeId=res['animeId'],
-            animeTitle=res['animeTitle'],
-            episodeTitle=res['episodeTitle'],
-            type=dandan_type,
-            typeDescription=dandan_type_desc,
-        )
-        return DandanMatchResponse(isMatched=True, matches=[match])
+    # --- 步骤 1: 尝试 TMDB 精确匹配 ---
+    title = parsed_info.title
+    potential_animes = await _shared_lookup(
+        lookup_cache, ("find_animes", title), lambda: crud.find_animes_for_matching(pool, title)
+    )
+    logger.debug("为标题 '%s' 找到 %d 个可能的库内作品进行TMDB匹配。", title, len(potential_animes))
+    tmdb_results = await _find_episodes_via_tmdb_candidates(pool, potential_animes, parsed_info)
+    if tmdb_results:
+        # TMDB 映射是高置信度的，直接取第一个结果（已按收藏和源排序）
+        return DandanMatchResponse(isMatched=True, matches=[_build_match_info(tmdb_results[0])])
 
-    # 如果没有精确标记，则只有当结果唯一时才算成功
+    # --- 步骤 2: 回退到旧的模糊搜索逻辑 ---
+    episode, season = parsed_info.episode, parsed_info.season
+    results = await _shared_lookup(
+        lookup_cache, ("search_episodes", title, episode, season),
+        lambda: crud.search_episodes_in_library(pool, title, episode, season)
+    )
+    logger.debug("模糊搜索为 '%s' (季:%s 集:%s) 找到 %d 条记录", title, season, episode, len(results))
+
+    if return_ambiguous:
+        # 对结果进行严格的标题过滤，避免模糊匹配带来的问题
+        normalized_search_title = title.translate(_NORMALIZE_TABLE)
+        if normalized_search_title:
+            exact_matches = [
+                r for r in results
+                if r['animeTitle'].translate(_NORMALIZE_TABLE) == normalized_search_title
+            ]
+            if len(exact_matches) < len(results):
+                logger.debug("过滤掉 %d 条模糊匹配的结果。", len(results) - len(exact_matches))
+                results = exact_matches
+        if not results:
+            return DandanMatchResponse(isMatched=False, matches=[])
+
+    # 结果唯一时无论是否被精确标记都直接匹配成功，先做最便宜的判断
     if len(results) == 1:
-        res = results[0]
-        dandan_type = DANDAN_TYPE_MAPPING.get(res.get('type'), "other")
-        dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(res.get('type'), "其他")
+        return DandanMatchResponse(isMatched=True, matches=[_build_match_info(results[0])])
 
-        match = DandanMatchInfo(
-            episodeId=res['episodeId'],
-            animeId=res['animeId'],
-            animeTitle=res['animeTitle'],
-            episodeTitle=res['episodeTitle'],
-            type=dandan_type,
-            typeDescription=dandan_type_desc,
-        )
-        return DandanMatchResponse(isMatched=True, matches=[match])
-    
-    return DandanMatchResponse(isMatched=False)
+    # 一次遍历同时查找被精确标记的源并检查所有结果是否属于同一番剧；
+    # 精确标记优先级最高，找到后即可停止遍历
+    first_anime_id = results[0]['animeId']
+    all_same_anime = True
+    for res in results:
+        if res.get('isFavorited'):
+            return DandanMatchResponse(isMatched=True, matches=[_build_match_info(res)])
+        if all_same_anime and res['animeId'] != first_anime_id:
+            all_same_anime = False
+
+    # 如果没有精确标记，批量匹配只接受唯一结果
+    if not return_ambiguous:
+        return DandanMatchResponse(isMatched=False)
+
+    if all_same_anime:
+        # 结果已由数据库按 标题长度和源顺序 排序，直接取第一个
+        return DandanMatchResponse(isMatched=True, matches=[_build_match_info(results[0])])
+
+    # 如果匹配到了多个不同的番剧，则返回所有结果让用户选择
+    return DandanMatchResponse(isMatched=False, matches=[_build_match_info(res) for res in results])
 
 @implementation_router.post(
     "/match",
     response_model=DandanMatchResponse,
-    summary="[dandanplay兼容] 匹配单个文件"
+    summary="[dandanplay兼容] 匹配单个文件",
+    openapi_extra=_request_body_openapi(_MATCH_ITEM_ADAPTER)
 )
 async def match_single_file(
-    request: DandanBatchMatchRequestItem,
+    raw_request: Request,
     token: str = Depends(get_token_from_path),
     pool: aiomysql.Pool = Depends(get_db_pool)
 ):
@@ -598,145 +791,47 @@ async def match_single_file(
     通过文件名匹配弹幕库。此接口不使用文件Hash。
     优先使用 TMDB 映射进行精确匹配，失败则回退到标题模糊搜索。
     """
-    logger.info(f"收到 /match 请求, 文件名: '{request.fileName}'")
-    parsed_info = _parse_filename_for_match(request.fileName)
-    logger.info(f"文件名解析结果: {parsed_info}")
-    if not parsed_info:
-        response = DandanMatchResponse(isMatched=False)
-        logger.info(f"发送 /match 响应 (解析失败): {response.model_dump_json(indent=2)}")
-        return response
-
-    # --- 步骤 1: 尝试 TMDB 精确匹配 ---
-    potential_animes = await crud.find_animes_for_matching(pool, parsed_info["title"])
-    logger.info(f"为标题 '{parsed_info['title']}' 找到 {len(potential_animes)} 个可能的库内作品进行TMDB匹配。")
-
-    for anime in potential_animes:
-        if anime.get("tmdb_id") and anime.get("tmdb_episode_group_id"):
-            logger.info(f"正在为作品 ID {anime['anime_id']} (TMDB ID: {anime['tmdb_id']}) 尝试 TMDB 映射匹配...")
-            tmdb_results = await crud.find_episode_via_tmdb_mapping(
-                pool,
-                tmdb_id=anime["tmdb_id"],
-                group_id=anime["tmdb_episode_group_id"],
-                custom_season=parsed_info.get("season"),
-                custom_episode=parsed_info["episode"]
-            )
-            if tmdb_results:
-                logger.info(f"TMDB 映射匹配成功，找到 {len(tmdb_results)} 个结果。")
-                # TMDB 映射是高置信度的，直接取第一个结果（已按收藏和源排序）
-                res = tmdb_results[0]
-                dandan_type = DANDAN_TYPE_MAPPING.get(res.get('type'), "other")
-                dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(res.get('type'), "其他")
-                match = DandanMatchInfo(
-                    episodeId=res['episodeId'], animeId=res['animeId'], animeTitle=res['animeTitle'],
-                    episodeTitle=res['episodeTitle'], type=dandan_type, typeDescription=dandan_type_desc,
-                )
-                response = DandanMatchResponse(isMatched=True, matches=[match])
-                logger.info(f"发送 /match 响应 (TMDB 映射匹配): {response.model_dump_json(indent=2)}")
-                return response
-
-    # --- 步骤 2: 回退到旧的模糊搜索逻辑 ---
-    logger.info("TMDB 映射匹配失败或无可用映射，回退到标题模糊搜索。")
-    results = await crud.search_episodes_in_library(
-        pool, parsed_info["title"], parsed_info["episode"], parsed_info.get("season")
-    )
-    logger.info(f"模糊搜索为 '{parsed_info['title']}' (季:{parsed_info.get('season')} 集:{parsed_info.get('episode')}) 找到 {len(results)} 条记录")
-    
-    # 新增：对结果进行严格的标题过滤，避免模糊匹配带来的问题
-    normalized_search_title = parsed_info["title"].replace("：", ":").replace(" ", "")
-    if normalized_search_title:
-        exact_matches = [
-            r for r in results 
-            if r['animeTitle'].replace("：", ":").replace(" ", "") == normalized_search_title
-        ]
-        if len(exact_matches) < len(results):
-            logger.info(f"过滤掉 {len(results) - len(exact_matches)} 条模糊匹配的结果。")
-            results = exact_matches
-
-    if not results:
-        response = DandanMatchResponse(isMatched=False, matches=[])
-        logger.info(f"发送 /match 响应 (无精确匹配): {response.model_dump_json(indent=2)}")
-        return response
-
-    # 优先处理被精确标记的源
-    favorited_results = [r for r in results if r.get('isFavorited')]
-    if favorited_results:
-        res = favorited_results[0]
-        dandan_type = DANDAN_TYPE_MAPPING.get(res.get('type'), "other")
-        dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(res.get('type'), "其他")
-
-        match = DandanMatchInfo(
-            episodeId=res['episodeId'],
-            animeId=res['animeId'],
-            animeTitle=res['animeTitle'],
-            episodeTitle=res['episodeTitle'],
-            type=dandan_type,
-            typeDescription=dandan_type_desc,
-        )
-        response = DandanMatchResponse(isMatched=True, matches=[match])
-        logger.info(f"发送 /match 响应 (精确标记匹配): {response.model_dump_json(indent=2)}")
-        return response
-
-    # 如果没有精确标记，检查所有匹配项是否都指向同一个番剧ID
-    first_anime_id = results[0]['animeId']
-    all_from_same_anime = all(res['animeId'] == first_anime_id for res in results)
-
-    if all_from_same_anime:
-        # 结果已由数据库按 标题长度和源顺序 排序，直接取第一个
-        res = results[0]
-        dandan_type = DANDAN_TYPE_MAPPING.get(res.get('type'), "other")
-        dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(res.get('type'), "其他")
-
-        match = DandanMatchInfo(
-            episodeId=res['episodeId'],
-            animeId=res['animeId'],
-            animeTitle=res['animeTitle'],
-            episodeTitle=res['episodeTitle'],
-            type=dandan_type,
-            typeDescription=dandan_type_desc,
-        )
-        response = DandanMatchResponse(isMatched=True, matches=[match])
-        logger.info(f"发送 /match 响应 (单一作品匹配): {response.model_dump_json(indent=2)}")
-        return response
-
-    # 如果匹配到了多个不同的番剧，则返回所有结果让用户选择
-    matches = []
-    for res in results:
-        dandan_type = DANDAN_TYPE_MAPPING.get(res.get('type'), "other")
-        dandan_type_desc = DANDAN_TYPE_DESC_MAPPING.get(res.get('type'), "其他")
-
-        matches.append(DandanMatchInfo(
-            episodeId=res['episodeId'],
-            animeId=res['animeId'],
-            animeTitle=res['animeTitle'],
-            episodeTitle=res['episodeTitle'],
-            type=dandan_type,
-            typeDescription=dandan_type_desc,
-        ))
-
-    response = DandanMatchResponse(isMatched=False, matches=matches)
-    logger.info(f"发送 /match 响应 (多个匹配): {response.model_dump_json(indent=2)}")
-    return response
+    request: DandanBatchMatchRequestItem = await _parse_request_body(raw_request, _MATCH_ITEM_ADAPTER)
+    logger.debug("收到 /match 请求, 文件名: '%s'", request.fileName)
+    response = await _process_single_batch_match(request, pool, return_ambiguous=True)
+    # INFO 级别只记录简要结果；完整的响应序列化只在 DEBUG 级别下进行，避免在请求路径上额外序列化一次
+    logger.info("/match: '%s' -> 匹配成功=%s, 候选数=%d", request.fileName, response.isMatched, len(response.matches))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("发送 /match 响应: %s", response.model_dump_json())
+    return _dandan_response(response)
 
 
 @implementation_router.post(
     "/match/batch",
     response_model=List[DandanMatchResponse],
-    summary="[dandanplay兼容] 批量匹配文件"
+    summary="[dandanplay兼容] 批量匹配文件",
+    openapi_extra=_request_body_openapi(_BATCH_MATCH_ADAPTER)
 )
 async def match_batch_files(
-    request: DandanBatchMatchRequest,
+    raw_request: Request,
     token: str = Depends(get_token_from_path),
     pool: aiomysql.Pool = Depends(get_db_pool)
 ):
     """
     批量匹配文件，只返回精确匹配（1个结果）的项。
     """
+    request: DandanBatchMatchRequest = await _parse_request_body(raw_request, _BATCH_MATCH_ADAPTER)
     if len(request.requests) > 32:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="批量匹配请求不能超过32个文件。")
 
-    tasks = [_process_single_batch_match(item, pool) for item in request.requests]
+    # 同一批次中的文件通常来自同一部作品，相同标题的查询只执行一次
+    lookup_cache: Dict[tuple, asyncio.Future] = {}
+    await _prefetch_batch_lookups(pool, request.requests, lookup_cache)
+    tasks = [_process_single_batch_match(item, pool, lookup_cache) for item in request.requests]
     results = await asyncio.gather(*tasks)
-    return results
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("文件名解析缓存命中情况: %s", _parse_filename_for_match.cache_info())
+    return ORJSONResponse([res.model_dump() for res in results])
+
+@functools.lru_cache(maxsize=None)
+def _get_opencc_converter(config: str) -> OpenCC:
+    """OpenCC 初始化时需加载转换词典，开销较大，每种转换只创建一次并复用。"""
+    return OpenCC(config)
 
 @implementation_router.get(
     "/comment/{episode_id}",
@@ -758,37 +853,42 @@ async def get_comments_for_dandan(
     注意：这里的 episode_id 实际上是我们数据库中的主键 ID。
     """
     # 注意：当前实现尚未使用 from_time 和 with_related 参数。
+    if ch_convert not in [1, 2]:
+        # 无需繁简转换时，由数据库直接组装好整个响应的 JSON，原样返回给客户端
+        return Response(content=await crud.fetch_comments_json(pool, episode_id), media_type="application/json")
+
     comments_data = await crud.fetch_comments(pool, episode_id)
 
-    # 如果客户端请求了繁简转换，则在此处处理
-    if ch_convert in [1, 2]:
-        converter = None
-        if ch_convert == 1:
-            converter = OpenCC('t2s')  # Traditional to Simplified
-        elif ch_convert == 2:
-            converter = OpenCC('s2t')  # Simplified to Traditional
-        
-        if converter:
-            for comment in comments_data:
-                comment['m'] = converter.convert(comment['m'])
-
-    # 为了避免日志过长，只打印部分弹幕作为示例
-    log_limit = 5
-    comments_to_log = comments_data[:log_limit]
-    log_message = {
-        "total_comments": len(comments_data),
-        "comments_sample": comments_to_log
-    }
-    # UA 已由 get_token_from_path 依赖项记录
-    # logger.info(f"弹幕接口响应 (episode_id: {episode_id}):\n{json.dumps(log_message, indent=2, ensure_ascii=False)}")
-
-    comments = [models.Comment(cid=item["cid"], p=item["p"], m=item["m"]) for item in comments_data]
-    return models.CommentResponse(count=len(comments), comments=comments)
+    # 客户端请求了繁简转换: 1-转换为简体，2-转换为繁体
+    converter = _get_opencc_converter('t2s' if ch_convert == 1 else 's2t')
+    for comment in comments_data:
+        comment['m'] = converter.convert(comment['m'])
 
-# --- 路由挂载 ---
-# 将实现路由挂载到主路由上，以支持两种URL结构。
+    # UA 已由 get_token_from_path 依赖项记录；为了避免日志过长，只在 DEBUG 级别下打印部分弹幕作为示例
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("弹幕接口响应 (episode_id: %s): 共 %d 条, 示例: %s", episode_id, len(comments_data), comments_data[:5])
+
+    # 查询结果的列 (cid, p, m) 已与 models.Comment 一致，直接序列化，无需为每条弹幕构建模型对象
+    return ORJSONResponse({"count": len(comments_data), "comments": comments_data})
 
-# 2. 挂载以支持兼容路径: /api/{token}/api/v2/bangumi/{anime_id}
-dandan_router.include_router(implementation_router, prefix="/{token}/api/v2")
-# 1. 挂载以支持直接路径: /api/{token}/bangumi/{anime_id}
+# --- 路由挂载 ---
+# 支持两种URL结构:
+# 1. 直接路径: /api/{token}/bangumi/{anime_id}
+# 2. 兼容路径: /api/{token}/api/v2/bangumi/{anime_id}
+# 实现路由只挂载一次 (直接路径)，兼容路径由 DandanPathRewriteMiddleware 在路由匹配前改写，
+# 这样每个请求的路由匹配不必扫描两份相同的路由表。
 dandan_router.include_router(implementation_router, prefix="/{token}")
+
+_V2_COMPAT_PATH_RE = re.compile(r'^(/api/[^/]+)/api/v2(/.*)$')
+
+class DandanPathRewriteMiddleware:
+    """纯 ASGI 中间件：将 /api/{token}/api/v2/... 改写为 /api/{token}/...。"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            match = _V2_COMPAT_PATH_RE.match(scope["path"])
+            if match:
+                scope = dict(scope, path=match.group(1) + match.group(2))
+        await self.app(scope, receive, send)
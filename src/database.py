@@ -9,6 +9,13 @@ from pymysql.err import OperationalError
 # 使用模块级日志记录器
 logger = logging.getLogger(__name__)
 
+# task_history.status_code 生成列的定义：将中文状态映射为 TINYINT，用于索引和过滤。
+# 0-排队中, 1-运行中, 2-已完成, 3-失败, 4-已暂停 (与 task_manager.TaskStatus 对应)
+TASK_STATUS_CODE_COLUMN = (
+    "`status_code` TINYINT AS (CASE `status` WHEN '排队中' THEN 0 WHEN '运行中' THEN 1 "
+    "WHEN '已完成' THEN 2 WHEN '失败' THEN 3 WHEN '已暂停' THEN 4 ELSE NULL END) STORED"
+)
+
 
 async def create_db_pool(app: FastAPI) -> aiomysql.Pool:
     """创建数据库连接池并存储在 app.state 中"""
@@ -19,9 +26,12 @@ async def create_db_pool(app: FastAPI) -> aiomysql.Pool:
             user=settings.database.user,
             password=settings.database.password,
             db=settings.database.name,
+            minsize=settings.database.pool_minsize,
+            maxsize=settings.database.pool_maxsize,
+            pool_recycle=settings.database.pool_recycle,
             autocommit=True  # 建议在Web应用中开启自动提交
         )
-        logger.info("数据库连接池创建成功。")
+        logger.info(f"数据库连接池创建成功 (minsize={settings.database.pool_minsize}, maxsize={settings.database.pool_maxsize})。")
         return app.state.db_pool
     except OperationalError as e:
         # 捕获特定的 OperationalError 以提供更具指导性的错误消息
@@ -123,7 +133,7 @@ async def init_db_tables(app: FastAPI):
                 "comment": """CREATE TABLE `comment` (`id` BIGINT NOT NULL AUTO_INCREMENT, `cid` VARCHAR(255) NOT NULL, `episode_id` BIGINT NOT NULL, `p` VARCHAR(255) NOT NULL, `m` TEXT NOT NULL, `t` DECIMAL(10, 2) NOT NULL, PRIMARY KEY (`id`), UNIQUE INDEX `idx_episode_cid_unique` (`episode_id` ASC, `cid` ASC), INDEX `idx_episode_time` (`episode_id` ASC, `t` ASC)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
                 "users": """CREATE TABLE `users` (`id` BIGINT NOT NULL AUTO_INCREMENT, `username` VARCHAR(50) NOT NULL, `hashed_password` VARCHAR(255) NOT NULL, `token` TEXT NULL, `token_update` TIMESTAMP NULL, `created_at` TIMESTAMP NULL, PRIMARY KEY (`id`), UNIQUE INDEX `idx_username_unique` (`username` ASC)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
                 "scrapers": """CREATE TABLE `scrapers` (`provider_name` VARCHAR(50) NOT NULL, `is_enabled` BOOLEAN NOT NULL DEFAULT TRUE, `display_order` INT NOT NULL DEFAULT 0, PRIMARY KEY (`provider_name`)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
-                "anime_sources": """CREATE TABLE `anime_sources` (`id` BIGINT NOT NULL AUTO_INCREMENT, `anime_id` BIGINT NOT NULL, `provider_name` VARCHAR(50) NOT NULL, `media_id` VARCHAR(255) NOT NULL, `is_favorited` BOOLEAN NOT NULL DEFAULT FALSE, `created_at` TIMESTAMP NULL, PRIMARY KEY (`id`), UNIQUE INDEX `idx_anime_provider_media_unique` (`anime_id` ASC, `provider_name` ASC, `media_id` ASC)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
+                "anime_sources": """CREATE TABLE `anime_sources` (`id` BIGINT NOT NULL AUTO_INCREMENT, `anime_id` BIGINT NOT NULL, `provider_name` VARCHAR(50) NOT NULL, `media_id` VARCHAR(255) NOT NULL, `is_favorited` BOOLEAN NOT NULL DEFAULT FALSE, `created_at` TIMESTAMP NULL, PRIMARY KEY (`id`), UNIQUE INDEX `idx_anime_provider_media_unique` (`anime_id` ASC, `provider_name` ASC, `media_id` ASC), INDEX `idx_anime_favorited` (`anime_id` ASC, `is_favorited` ASC)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
                 "anime_metadata": """CREATE TABLE `anime_metadata` (`id` BIGINT NOT NULL AUTO_INCREMENT, `anime_id` BIGINT NOT NULL, `tmdb_id` VARCHAR(50) NULL, `tmdb_episode_group_id` VARCHAR(50) NULL, `imdb_id` VARCHAR(50) NULL, `tvdb_id` VARCHAR(50) NULL, `douban_id` VARCHAR(50) NULL, `bangumi_id` VARCHAR(50) NULL, PRIMARY KEY (`id`), UNIQUE INDEX `idx_anime_id_unique` (`anime_id` ASC), CONSTRAINT `fk_metadata_anime` FOREIGN KEY (`anime_id`) REFERENCES `anime`(`id`) ON DELETE CASCADE) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
                 "config": """CREATE TABLE `config` (`config_key` VARCHAR(100) NOT NULL, `config_value` TEXT NOT NULL, `description` TEXT NULL, PRIMARY KEY (`config_key`)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
                 "cache_data": """CREATE TABLE `cache_data` (`cache_provider` VARCHAR(50) NULL, `cache_key` VARCHAR(255) NOT NULL, `cache_value` LONGTEXT NOT NULL, `expires_at` TIMESTAMP NOT NULL, PRIMARY KEY (`cache_key`), INDEX `idx_expires_at` (`expires_at`)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
@@ -135,7 +145,7 @@ async def init_db_tables(app: FastAPI):
                 "anime_aliases": """CREATE TABLE `anime_aliases` (`id` BIGINT NOT NULL AUTO_INCREMENT, `anime_id` BIGINT NOT NULL, `name_en` VARCHAR(255) NULL, `name_jp` VARCHAR(255) NULL, `name_romaji` VARCHAR(255) NULL, `alias_cn_1` VARCHAR(255) NULL, `alias_cn_2` VARCHAR(255) NULL, `alias_cn_3` VARCHAR(255) NULL, PRIMARY KEY (`id`), UNIQUE INDEX `idx_anime_id_unique` (`anime_id` ASC), CONSTRAINT `fk_aliases_anime` FOREIGN KEY (`anime_id`) REFERENCES `anime`(`id`) ON DELETE CASCADE) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
                 "tmdb_episode_mapping": """CREATE TABLE `tmdb_episode_mapping` (`id` BIGINT NOT NULL AUTO_INCREMENT, `tmdb_tv_id` INT NOT NULL, `tmdb_episode_group_id` VARCHAR(50) NOT NULL, `tmdb_episode_id` INT NOT NULL, `tmdb_season_number` INT NOT NULL, `tmdb_episode_number` INT NOT NULL, `custom_season_number` INT NOT NULL, `custom_episode_number` INT NOT NULL, `absolute_episode_number` INT NOT NULL, PRIMARY KEY (`id`), UNIQUE KEY `idx_group_episode_unique` (`tmdb_episode_group_id`, `tmdb_episode_id`), INDEX `idx_custom_season_episode` (`tmdb_tv_id`, `tmdb_episode_group_id`, `custom_season_number`, `custom_episode_number`), INDEX `idx_absolute_episode` (`tmdb_tv_id`, `tmdb_episode_group_id`, `absolute_episode_number`)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
                 "scheduled_tasks": """CREATE TABLE `scheduled_tasks` (`id` VARCHAR(100) NOT NULL, `name` VARCHAR(255) NOT NULL, `job_type` VARCHAR(50) NOT NULL, `cron_expression` VARCHAR(100) NOT NULL, `is_enabled` BOOLEAN NOT NULL DEFAULT TRUE, `last_run_at` TIMESTAMP NULL, `next_run_at` TIMESTAMP NULL, PRIMARY KEY (`id`)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
-                "task_history": """CREATE TABLE `task_history` (`id` VARCHAR(100) NOT NULL, `title` VARCHAR(255) NOT NULL, `status` VARCHAR(50) NOT NULL, `progress` INT NOT NULL DEFAULT 0, `description` TEXT NULL, `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, `finished_at` TIMESTAMP NULL, PRIMARY KEY (`id`), INDEX `idx_created_at` (`created_at` DESC)) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
+                "task_history": f"""CREATE TABLE `task_history` (`id` VARCHAR(100) NOT NULL, `title` VARCHAR(255) NOT NULL, `status` VARCHAR(50) NOT NULL, {TASK_STATUS_CODE_COLUMN}, `progress` INT NOT NULL DEFAULT 0, `description` TEXT NULL, `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, `finished_at` TIMESTAMP NULL, PRIMARY KEY (`id`), INDEX `idx_created_at` (`created_at` DESC), INDEX `idx_status_code_created_at` (`status_code`, `created_at` DESC, `id`), FULLTEXT INDEX `idx_title_fulltext` (`title`) WITH PARSER ngram) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;""",
             }
 
             # 先获取数据库中所有已存在的表
@@ -189,6 +199,20 @@ async def init_db_tables(app: FastAPI):
                     logger.info("检测到旧的 'config.config_value' 列定义，正在将其更新为 TEXT...")
                     await cursor.execute("ALTER TABLE config MODIFY COLUMN config_value TEXT NOT NULL;")
                     logger.info("列 'config.config_value' 更新成功。")
+
+                # 新增：检查并补充后续版本新增的索引
+                await _ensure_index(cursor, db_name, 'anime_sources', 'idx_anime_favorited', '(anime_id, is_favorited)')
+                # 新增：检查 task_history.status_code 生成列
+                await cursor.execute("""
+                    SELECT 1 FROM INFORMATION_SCHEMA.COLUMNS
+                    WHERE TABLE_SCHEMA = %s AND TABLE_NAME = 'task_history' AND COLUMN_NAME = 'status_code'
+                """, (db_name,))
+                if not await cursor.fetchone():
+                    logger.info("正在为 'task_history' 添加生成列 'status_code'...")
+                    await cursor.execute(f"ALTER TABLE task_history ADD COLUMN {TASK_STATUS_CODE_COLUMN} AFTER status;")
+                    logger.info("列 'task_history.status_code' 添加成功。")
+                await _ensure_index(cursor, db_name, 'task_history', 'idx_status_code_created_at', '(status_code, created_at DESC, id)')
+                await _ensure_index(cursor, db_name, 'task_history', 'idx_title_fulltext', '(title) WITH PARSER ngram', 'FULLTEXT INDEX')
             except Exception as e:
                 # 仅记录错误，不中断启动流程
                 logger.warning(f"检查或更新表结构时发生非致命错误: {e}")
@@ -196,6 +220,17 @@ async def init_db_tables(app: FastAPI):
             # --- 步骤 3.2: 初始化默认配置 ---
             await _init_default_config(cursor)
 
+async def _ensure_index(cursor: aiomysql.Cursor, db_name: str, table_name: str, index_name: str, columns: str, index_type: str = "INDEX"):
+    """如果指定的索引不存在，则为旧的表结构添加它。index_type 可为 'INDEX' 或 'FULLTEXT INDEX'。"""
+    await cursor.execute("""
+        SELECT 1 FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (db_name, table_name, index_name))
+    if not await cursor.fetchone():
+        logger.info(f"正在为 '{table_name}' 添加索引 '{index_name}'...")
+        await cursor.execute(f"CREATE {index_type} `{index_name}` ON `{table_name}` {columns};")
+        logger.info(f"索引 '{index_name}' 添加成功。")
+
 async def _init_default_config(cursor: aiomysql.Cursor):
     """初始化配置表的默认值，并强制执行最低缓存时间。"""
     logger.info("正在检查并初始化默认配置...")
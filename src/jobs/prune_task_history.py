@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+from typing import Callable
+
+from .. import crud
+from .base import BaseJob
+from ..task_manager import TaskSuccess
+
+class PruneTaskHistoryJob(BaseJob):
+    job_type = "prune_task_history"
+    job_name = "清理过期任务历史"
+
+    async def run(self, progress_callback: Callable):
+        """删除超过保留天数的已完成/失败任务记录，防止 task_history 表无限增长。"""
+        retention_days_str = await crud.get_config_value(self.pool, "task_history_retention_days", "30")
+        try:
+            retention_days = max(1, int(retention_days_str))
+        except ValueError:
+            retention_days = 30
+        self.logger.info(f"开始执行 [{self.job_name}]，保留最近 {retention_days} 天的任务记录...")
+        progress_callback(10, f"正在删除 {retention_days} 天前的任务记录...")
+
+        before = datetime.now() - timedelta(days=retention_days)
+        deleted_count = await crud.delete_old_task_history(self.pool, before)
+
+        self.logger.info(f"定时任务 [{self.job_name}] 执行完毕，共删除 {deleted_count} 条记录。")
+        raise TaskSuccess(f"任务执行完毕，共删除 {deleted_count} 条过期任务记录。")
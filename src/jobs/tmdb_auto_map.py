@@ -119,13 +119,13 @@ class TmdbAutoMapJob(BaseJob):
             raise
 
         async with client:
-            shows_to_update = await crud.get_animes_with_tmdb_id(self.pool)
-            total_shows = len(shows_to_update)
+            total_shows = await crud.count_animes_with_tmdb_id(self.pool)
             self.logger.info(f"找到 {total_shows} 个带TMDB ID的电视节目需要处理。")
             progress_callback(5, f"找到 {total_shows} 个节目待处理")
 
-            for i, show in enumerate(shows_to_update):
-                current_progress = 5 + int((i / total_shows) * 95) if total_shows > 0 else 95
+            i = 0
+            async for show in crud.get_animes_with_tmdb_id(self.pool):
+                current_progress = 5 + int((min(i, total_shows) / total_shows) * 95) if total_shows > 0 else 95
                 progress_callback(current_progress, f"正在处理: {show['title']} ({i+1}/{total_shows})")
 
                 anime_id, tmdb_id, title = show['anime_id'], show['tmdb_id'], show['title']
@@ -150,6 +150,7 @@ class TmdbAutoMapJob(BaseJob):
                     await asyncio.sleep(1)
                 except Exception as e:
                     self.logger.error(f"处理 '{title}' (TMDB ID: {tmdb_id}) 时发生错误: {e}", exc_info=True)
+                i += 1
         
         self.logger.info(f"定时任务 [{self.job_name}] 执行完毕。")
         # 修正：抛出 TaskSuccess 异常，以便 TaskManager 可以用一个有意义的消息来结束任务
@@ -3,6 +3,7 @@ import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends
 import logging
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, HTMLResponse
 import json
@@ -14,7 +15,7 @@ from .api.webhook_api import router as webhook_router
 from .api.imdb_api import router as imdb_router
 from .api.tvdb_api import router as tvdb_router
 from .api.douban_api import router as douban_router
-from .dandan_api import dandan_router
+from .dandan_api import dandan_router, DandanPathRewriteMiddleware
 from .task_manager import TaskManager
 from .scraper_manager import ScraperManager
 from .webhook_manager import WebhookManager
@@ -43,6 +44,8 @@ async def lifespan(app: FastAPI):
     app.state.task_manager.start()
     await create_initial_admin_user(app)
     app.state.cleanup_task = asyncio.create_task(cleanup_task(app))
+    app.state.write_flush_task = asyncio.create_task(write_flush_task(app))
+    app.state.access_log_task = asyncio.create_task(crud.token_access_log_worker(pool))
     app.state.scheduler_manager = SchedulerManager(pool, app.state.task_manager)
     await app.state.scheduler_manager.start()
     
@@ -55,6 +58,23 @@ async def lifespan(app: FastAPI):
             await app.state.cleanup_task
         except asyncio.CancelledError:
             pass
+    if hasattr(app.state, "write_flush_task"):
+        app.state.write_flush_task.cancel()
+        try:
+            await app.state.write_flush_task
+        except asyncio.CancelledError:
+            pass
+        # 关闭连接池前写入剩余的待写入数据
+        await crud.flush_task_history_and_run_times(app.state.db_pool)
+        await crud.flush_episode_fetch_times(app.state.db_pool)
+    if hasattr(app.state, "access_log_task"):
+        app.state.access_log_task.cancel()
+        try:
+            await app.state.access_log_task
+        except asyncio.CancelledError:
+            pass
+        # 关闭连接池前写入队列中剩余的访问日志
+        await crud.flush_token_access_logs(app.state.db_pool)
     await close_db_pool(app)
     if hasattr(app.state, "scraper_manager"):
         await app.state.scraper_manager.close_all()
@@ -97,6 +117,11 @@ async def log_not_found_requests(request: Request, call_next):
         logging.getLogger(__name__).warning("未处理的请求详情 (原始请求范围):\n%s", json.dumps(log_details, indent=2, ensure_ascii=False))
     return response
 
+# dandanplay 兼容路径 /api/{token}/api/v2/... 在路由匹配前改写为 /api/{token}/...
+app.add_middleware(DandanPathRewriteMiddleware)
+# 弹幕等 JSON 响应重复度很高，压缩后体积可减少数倍；过小的响应不值得压缩
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=4)
+
 async def cleanup_task(app: FastAPI):
     """定期清理过期缓存和OAuth states的后台任务。"""
     pool = app.state.db_pool
@@ -110,6 +135,19 @@ async def cleanup_task(app: FastAPI):
         except Exception as e:
             logging.getLogger(__name__).error(f"缓存清理任务出错: {e}")
 
+async def write_flush_task(app: FastAPI):
+    """定期将任务历史、分集采集时间和定时任务运行时间批量写入数据库的后台任务。"""
+    pool = app.state.db_pool
+    while True:
+        try:
+            await asyncio.sleep(0.1)
+            await crud.flush_task_history_and_run_times(pool)
+            await crud.flush_episode_fetch_times(pool)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logging.getLogger(__name__).error(f"批量写入数据库出错: {e}")
+
 # 挂载静态文件目录
 # 注意：这应该在项目根目录运行，以便能找到 'static' 文件夹
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -167,6 +167,8 @@ class TaskInfo(BaseModel):
     status: str
     progress: int
     description: str
+    # 创建时间，与 task_id 一起作为获取下一页的游标
+    created_at: Optional[datetime] = None
 
 # --- API Token 管理模型 ---
 class ApiTokenInfo(BaseModel):
@@ -98,6 +98,7 @@ class SchedulerManager:
 
     async def load_jobs_from_db(self):
         tasks = await crud.get_scheduled_tasks(self.pool)
+        run_times_to_update = []
         for task in tasks:
             if task['job_type'] in self._job_classes:
                 try:
@@ -105,9 +106,11 @@ class SchedulerManager:
                     job = self.scheduler.add_job(runner, CronTrigger.from_crontab(task['cron_expression']), id=task['id'], name=task['name'], replace_existing=True)
                     if not task['is_enabled']: self.scheduler.pause_job(task['id'])
                     # When loading, the job object is new and has no last_run_time. We only need to update the next_run_time.
-                    await crud.update_scheduled_task_run_times(self.pool, job.id, task['last_run_at'], job.next_run_time)
+                    run_times_to_update.append((task['last_run_at'], job.next_run_time, job.id))
                 except Exception as e:
                     logger.error(f"加载定时任务 '{task['name']}' (ID: {task['id']}) 失败: {e}")
+        # 所有任务的运行时间在一个事务中统一写入
+        await crud.update_many_scheduled_task_run_times(self.pool, run_times_to_update)
 
     async def get_all_tasks(self) -> List[Dict[str, Any]]:
         """从数据库获取所有定时任务的列表。"""